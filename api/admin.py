@@ -1,3 +1,132 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .models import (
+    User,
+    ProductCategory,
+    Task,
+    SubTask,
+    ProductSerial,
+    SerialSubTaskStatus
+)
+from . import rollups
+
+
+# ------------------------------
+# Estimated counts for large tables
+# ------------------------------
+def estimated_row_count(model, using='default'):
+    """Row count from SQLite's ANALYZE statistics, or None when there are none"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [model._meta.db_table])
+            row = cursor.fetchone()
+    except DatabaseError:  # sqlite_stat1 only exists after the first ANALYZE
+        return None
+    return int(row[0].split()[0]) if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Skip COUNT(*) on unfiltered changelists of big tables"""
+    EXACT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.EXACT_BELOW:
+                return estimate
+        return super().count
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+# ------------------------------
+# Registrations
+# ------------------------------
+@admin.register(User)
+class UserAdmin(ScalableModelAdmin):
+    list_display = ['id', 'name', 'designation', 'email']
+    search_fields = ['name', 'email']
+
+
+@admin.register(ProductCategory)
+class ProductCategoryAdmin(ScalableModelAdmin):
+    list_display = ['id', 'name']
+    search_fields = ['name']
+
+
+@admin.register(Task)
+class TaskAdmin(ScalableModelAdmin):
+    list_display = ['id', 'name', 'category']
+    list_select_related = ['category']
+    list_filter = ['category']
+    search_fields = ['name']
+    autocomplete_fields = ['category']
+
+
+@admin.register(SubTask)
+class SubTaskAdmin(ScalableModelAdmin):
+    list_display = ['id', 'name', 'task', 'status']
+    list_select_related = ['task__category']  # Task.__str__ shows the category name
+    list_filter = ['task__category']
+    search_fields = ['name']
+    autocomplete_fields = ['task']
+
+
+@admin.register(ProductSerial)
+class ProductSerialAdmin(ScalableModelAdmin):
+    list_display = ['serial_no', 'product', 'product_name', 'status', 'priority', 'claimed_by', 'lease_expires']
+    list_select_related = ['product']
+    list_filter = ['status', 'product']
+    search_fields = ['=serial_no']
+    autocomplete_fields = ['product', 'subtask']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact primary-key match; `=serial_no` would be a case-insensitive LIKE that can't use the index
+        if search_term:
+            return queryset.filter(serial_no=search_term.strip()), False
+        return queryset, False
+
+
+@admin.register(SerialSubTaskStatus)
+class SerialSubTaskStatusAdmin(ScalableModelAdmin):
+    list_display = ['id', 'serial_no', 'subtask', 'status', 'updated_by', 'update_time']
+    list_select_related = ['subtask__task']  # SubTask.__str__ shows the task name
+    list_filter = ['status', 'update_time']
+    search_fields = ['product_serial__serial_no']
+    raw_id_fields = ['product_serial']
+    autocomplete_fields = ['subtask']
+    # Derived from subtask (see SerialSubTaskStatus.save) and from the first result
+    readonly_fields = ['task', 'category', 'first_status']
+
+    @admin.display(description='Serial no', ordering='product_serial_id')
+    def serial_no(self, obj):
+        return obj.product_serial_id
+
+    def save_model(self, request, obj, form, change):
+        # Same bookkeeping as the API status writes: first_status, the result log and the rollups
+        before = None
+        if change:
+            before = rollups.snapshot(SerialSubTaskStatus.objects.get(pk=obj.pk))
+            if obj.status != before[3] and obj.update_time == before[2]:
+                obj.update_time = timezone.now()
+        if obj.status != 'pending' and obj.first_status is None:
+            obj.first_status = obj.status
+        super().save_model(request, obj, form, change)
+        rollups.apply_changes([(before, rollups.snapshot(obj))])
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term:
+            return queryset.filter(product_serial_id=search_term.strip()), False
+        return queryset, False
@@ -0,0 +1,111 @@
+"""
+Online SQLite backups that leave station traffic running.
+
+`online_backup()` copies a live database with SQLite's backup API a few
+pages at a time, sleeping between steps so writers can take the lock. A
+write from another connection makes SQLite restart the copy; after
+`max_restarts` restarts the rest is copied in a single step instead, which
+in WAL mode only holds a read snapshot and so still doesn't block writers.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def online_backup(source, destination, pages=256, sleep=0.05, max_restarts=5):
+    """Copy the SQLite file `source` to `destination`; returns the number of restarts"""
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts
+        last_remaining = remaining
+        # sqlite3's own `sleep` only applies when a step finds the database busy, not between steps
+        if remaining:
+            time.sleep(sleep)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(destination)
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+        except _TooManyRestarts:
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return restarts
+
+
+def quick_check(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("PRAGMA quick_check").fetchone()[0] == 'ok'
+    finally:
+        connection.close()
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot(source, directory, prefix, compress=False, checksum=False, verify=False, **backup_options):
+    """
+    Back `source` up into `directory` as <prefix>-<timestamp>.sqlite3[.gz], optionally with a
+    <file>.sha256 next to it. Returns the path of the backup file.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{prefix}-{datetime.now():%Y%m%d-%H%M%S-%f}.sqlite3" + ('.gz' if compress else '')
+    target = directory / name
+
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.backup-', suffix='.sqlite3')
+    os.close(fd)
+    try:
+        online_backup(source, temp, **backup_options)
+        if verify and not quick_check(temp):
+            raise sqlite3.DatabaseError(f"Backup of {source} failed PRAGMA quick_check")
+        if compress:
+            with open(temp, 'rb') as raw, gzip.open(f'{temp}.gz', 'wb') as packed:
+                shutil.copyfileobj(raw, packed)
+            os.replace(f'{temp}.gz', target)
+        else:
+            os.replace(temp, target)
+    finally:
+        for leftover in (temp, f'{temp}.gz'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    if checksum:
+        Path(f'{target}.sha256').write_text(f"{sha256_file(target)}  {name}\n")
+    return target
+
+
+def prune(directory, prefix, keep):
+    """Delete all but the newest `keep` backups of `prefix` (and their checksums); returns the deleted paths"""
+    backups = sorted(
+        path for path in Path(directory).glob(f'{prefix}-*.sqlite3*') if not path.name.endswith('.sha256')
+    )
+    removed = backups[:-keep] if keep else []
+    for path in removed:
+        path.unlink()
+        Path(f'{path}.sha256').unlink(missing_ok=True)
+    return removed
@@ -0,0 +1,180 @@
+"""
+In-process dispatch for POST /api/batch/: each sub-request is turned into a
+request object, resolved against the URLconf and handed straight to the view,
+so the client pays for one round-trip instead of one per call.
+
+Sub-requests share the batch request's user, session and plant database. Runs
+of consecutive GET sub-requests go to a thread pool (BATCH_READ_WORKERS)
+unless the batch is atomic, in which case everything runs in order inside one
+transaction that is rolled back as soon as a sub-request fails.
+"""
+import contextvars
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.urls import Resolver404, resolve
+
+from .routers import current_database
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+API_PREFIX = '/api/'
+
+_executor = None
+
+
+class BatchError(Exception):
+    """A malformed sub-request; reported in its slot with status 400"""
+
+
+class _Failed(Exception):
+    """Raised inside the atomic block to roll the batch back"""
+
+
+def _read_workers():
+    return getattr(settings, 'BATCH_READ_WORKERS', 4)
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_read_workers(), thread_name_prefix='batch-read')
+    return _executor
+
+
+def _sub_request(request, item):
+    """WSGIRequest for one sub-request, carrying the batch request's auth and session"""
+    method = str(item.get('method', 'GET')).upper()
+    if method not in METHODS:
+        raise BatchError(f"method must be one of {list(METHODS)}")
+    path = item.get('path')
+    if not isinstance(path, str) or not path.startswith(API_PREFIX):
+        raise BatchError(f"path must start with {API_PREFIX}")
+    path, _, query = path.partition('?')
+
+    body = item.get('body')
+    payload = b'' if body is None else json.dumps(body).encode()
+    meta = {key: value for key, value in request.META.items() if key != 'HTTP_IDEMPOTENCY_KEY'}
+    meta.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload),
+    })
+    headers = item.get('headers') or {}
+    if not isinstance(headers, dict) or not all(isinstance(name, str) for name in headers):
+        raise BatchError("headers must be an object")
+    for name, value in headers.items():
+        meta['HTTP_' + name.upper().replace('-', '_')] = str(value)
+
+    sub = WSGIRequest(meta)
+    sub.user = request.user
+    sub.session = request.session
+    sub._dont_enforce_csrf_checks = True  # the batch request itself went through CSRF checks
+    return sub
+
+
+def _dispatch(request, item, batch_view):
+    """Run one sub-request; returns {"status": ..., "body": ...}"""
+    try:
+        sub = _sub_request(request, item)
+        match = resolve(sub.path_info)
+    except BatchError as exc:
+        return {"status": 400, "body": {"error": str(exc)}}
+    except Resolver404:
+        return {"status": 404, "body": {"error": f"No route for {item.get('path')}"}}
+    if getattr(match.func, 'view_class', None) is batch_view:
+        return {"status": 400, "body": {"error": "Batches cannot be nested"}}
+
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+        body = _body(response)
+    except Exception:
+        logger.exception("Batch sub-request %s %s failed", sub.method, sub.path)
+        return {"status": 500, "body": {"error": "Internal server error"}}
+    return {"status": response.status_code, "body": body}
+
+
+def _body(response):
+    """JSON-able body of a sub-response; DRF data as is, otherwise the decoded content"""
+    body = getattr(response, 'data', None)
+    if body is not None:
+        return body
+    if response.streaming:
+        try:
+            content = b''.join(response.streaming_content)
+        finally:
+            response.close()
+    else:
+        if hasattr(response, 'render'):
+            response.render()
+        content = response.content
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode(errors='replace')
+
+
+def _dispatch_in_thread(request, item, batch_view):
+    try:
+        return _dispatch(request, item, batch_view)
+    finally:
+        connections.close_all()
+
+
+def run_batch(request, items, batch_view, atomic=False):
+    """(responses for `items` in order, whether an atomic batch was rolled back)"""
+    if atomic:
+        return _run_atomic(request, items, batch_view)
+
+    results = []
+    reads = []
+    for item in items:
+        if str(item.get('method', 'GET')).upper() == 'GET' and _read_workers() > 1:
+            reads.append(item)
+            continue
+        results.extend(_run_reads(request, reads, batch_view))
+        reads = []
+        results.append(_dispatch(request, item, batch_view))
+    results.extend(_run_reads(request, reads, batch_view))
+    return results, False
+
+
+def _run_reads(request, items, batch_view):
+    if len(items) < 2:
+        return [_dispatch(request, item, batch_view) for item in items]
+    # copy_context() keeps the plant database (routers.py) in the worker threads
+    futures = [
+        _pool().submit(contextvars.copy_context().run, _dispatch_in_thread, request, item, batch_view)
+        for item in items
+    ]
+    return [future.result() for future in futures]
+
+
+def _run_atomic(request, items, batch_view):
+    results = []
+    try:
+        with ExitStack() as stack:
+            for alias in {DEFAULT_DB_ALIAS, current_database()}:
+                stack.enter_context(transaction.atomic(using=alias))
+            for item in items:
+                result = _dispatch(request, item, batch_view)
+                results.append(result)
+                if result["status"] >= 400:
+                    raise _Failed
+    except _Failed:
+        skipped = {"status": 424, "body": {"error": "Not run: an earlier sub-request failed"}}
+        results.extend(skipped for _ in items[len(results):])
+        return results, True
+    return results, False
@@ -0,0 +1,126 @@
+"""
+Versioned, flat snapshots of the catalogue (categories, tasks, subtasks) for
+tablet start-up. A snapshot is rebuilt once per committed catalogue change
+(see signals.py) and clients holding an older version receive a diff.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import metrics
+from .models import ProductCategory, Task, SubTask, CatalogueSnapshot
+from .routers import plant_databases
+
+FIELDS = {
+    'categories': ['id', 'name', 'description'],
+    'tasks': ['id', 'category', 'name'],
+    'subtasks': ['id', 'task', 'name', 'description'],
+}
+
+
+# Model fields the snapshot depends on: FIELDS, plus the flag that hides a category being deleted
+SNAPSHOT_FIELDS = {
+    ProductCategory: {'name', 'description', 'deleting'},
+    Task: {'category', 'name'},
+    SubTask: {'task', 'name', 'description'},
+}
+
+
+def build_payload():
+    return {
+        'categories': [list(row) for row in ProductCategory.objects.filter(deleting=False).order_by('id').values_list(
+            'id', 'name', 'description')],
+        'tasks': [list(row) for row in Task.objects.filter(category__deleting=False).order_by('id').values_list(
+            'id', 'category_id', 'name')],
+        'subtasks': [list(row) for row in SubTask.objects.filter(task__category__deleting=False).order_by('id').values_list(
+            'id', 'task_id', 'name', 'description')],
+    }
+
+
+def latest_snapshot():
+    return CatalogueSnapshot.objects.order_by('-version').first()
+
+
+def sync_replicas():
+    """Copy the catalogue tables from 'default' into every plant database"""
+    aliases = list(plant_databases().values())
+    if not aliases:
+        return
+    replicated = (ProductCategory, Task, SubTask)  # parents first
+    rows = {model: list(model.objects.using(DEFAULT_DB_ALIAS).order_by('pk')) for model in replicated}
+    for alias in aliases:
+        with transaction.atomic(using=alias):
+            # Removing a catalogue row also removes the plant's serials / statuses under it
+            for model in reversed(replicated):
+                model.objects.using(alias).exclude(pk__in=[row.pk for row in rows[model]]).delete()
+            for model in replicated:
+                fields = [f.name for f in model._meta.concrete_fields if not f.primary_key]
+                model.objects.using(alias).bulk_create(
+                    rows[model], update_conflicts=True, unique_fields=['id'], update_fields=fields,
+                )
+
+
+def refresh_snapshot():
+    """
+    Store a new snapshot if the catalogue differs from the latest one; returns the latest snapshot.
+    Also brings the plant databases' catalogue copies up to date.
+    """
+    sync_replicas()
+    payload = build_payload()
+    checksum = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    latest = latest_snapshot()
+    if latest and latest.checksum == checksum:
+        return latest
+
+    snapshot = CatalogueSnapshot.objects.create(checksum=checksum, payload=payload)
+    keep = getattr(settings, 'CATALOGUE_SNAPSHOTS_KEPT', 50)
+    CatalogueSnapshot.objects.filter(version__lte=snapshot.version - keep).delete()
+    return snapshot
+
+
+class _Refresh:
+    """on_commit callback; `done` lets schedule_refresh() tell queued and finished refreshes apart"""
+    done = False
+
+    def __call__(self):
+        self.done = True
+        refresh_snapshot()
+
+
+def schedule_refresh():
+    """Refresh once after the current transaction commits, however many catalogue rows it touched"""
+    connection = transaction.get_connection()
+    if any(isinstance(func, _Refresh) and not func.done for _, func, _ in connection.run_on_commit):
+        return
+    transaction.on_commit(_Refresh())
+
+
+def diff(old_payload, new_payload):
+    """Rows added or changed, and ids removed, per entity"""
+    changes = {}
+    for entity in FIELDS:
+        old_rows = {row[0]: row for row in old_payload[entity]}
+        new_rows = {row[0]: row for row in new_payload[entity]}
+        changes[entity] = {
+            'upsert': [row for row_id, row in new_rows.items() if old_rows.get(row_id) != row],
+            'delete': [row_id for row_id in old_rows if row_id not in new_rows],
+        }
+    return changes
+
+
+def cached_diff(old_version, snapshot):
+    """Diff from `old_version` to `snapshot`, or None if that version is no longer kept"""
+    key = f'catalogue:diff:{old_version}:{snapshot.version}'
+    changes = cache.get(key)
+    metrics.record_cache('catalogue_diff', changes is not None)
+    if changes is None:
+        old = CatalogueSnapshot.objects.filter(version=old_version).values_list('payload', flat=True).first()
+        if old is None:
+            return None
+        changes = diff(old, snapshot.payload)
+        cache.set(key, changes, timeout=None)
+    return changes
@@ -0,0 +1,153 @@
+"""
+Optional group commit for SerialSubTaskStatus writes.
+
+With STATUS_WRITE_COALESCER['ENABLED'], SubTaskStatusUpdateView validates a
+request as usual and then hands its writes to one background thread per
+process. That thread collects writes for up to MAX_DELAY_MS (or MAX_BATCH
+writes), applies them in arrival order (so the last writer wins when two
+requests touch the same row) and commits them with a single bulk_update.
+Each request is answered once the batch holding its writes has committed.
+
+Only requests served by the same process can share a batch, so this pays
+off with threaded workers (e.g. gunicorn's gthread worker). Writes for
+different plant databases (routers.py) are committed separately.
+"""
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import rollups
+from .models import SerialSubTaskStatus
+from .routers import current_database, use_database
+
+KEEP = object()  # remark not sent: keep the stored value
+
+UPDATE_FIELDS = ['status', 'first_status', 'updated_by', 'remark', 'update_time']
+
+
+@dataclass
+class StatusWrite:
+    id: int
+    status: str
+    updated_by: str
+    update_time: object
+    remark: object = KEEP
+
+    def apply(self, instance):
+        """Same changes SerialSubTaskStatusSerializer.update() makes"""
+        instance.status = self.status
+        if instance.first_status is None and self.status != 'pending':
+            instance.first_status = self.status
+        if self.remark is not KEEP:
+            instance.remark = self.remark
+        instance.updated_by = self.updated_by
+        instance.update_time = self.update_time
+
+
+@dataclass
+class _Ticket:
+    writes: list
+    database: str
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Exception = None
+
+
+class StatusWriteCoalescer:
+
+    def __init__(self, max_delay_ms=5, max_batch=200, timeout=10):
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.batches_committed = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+    def submit(self, writes):
+        """Queue `writes` and block until the batch containing them has committed"""
+        ticket = _Ticket(writes, current_database())
+        self._ensure_worker()
+        self._queue.put(ticket)
+        if not ticket.done.wait(self.timeout):
+            raise TimeoutError("Status write batch did not commit in time")
+        if ticket.error is not None:
+            raise ticket.error
+
+    def _ensure_worker(self):
+        # A forked worker process inherits the object but not the thread
+        if self._worker is not None and self._worker.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name="status-write-coalescer", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].writes)
+            deadline = time.monotonic() + self.max_delay
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    ticket = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(ticket)
+                size += len(ticket.writes)
+            close_old_connections()
+            by_database = {}
+            for ticket in batch:
+                by_database.setdefault(ticket.database, []).append(ticket)
+            for database, tickets in by_database.items():
+                with use_database(database):
+                    self._flush(tickets)
+
+    def _flush(self, batch):
+        try:
+            with transaction.atomic(using=current_database()):
+                records = SerialSubTaskStatus.objects.in_bulk({w.id for t in batch for w in t.writes})
+                before = {pk: rollups.snapshot(r) for pk, r in records.items()}
+                for ticket in batch:
+                    for write in ticket.writes:
+                        if write.id in records:
+                            write.apply(records[write.id])
+                SerialSubTaskStatus.objects.bulk_update(records.values(), UPDATE_FIELDS)
+                rollups.apply_changes((before[pk], rollups.snapshot(r)) for pk, r in records.items())
+            self.batches_committed += 1
+        except Exception as exc:
+            for ticket in batch:
+                ticket.error = exc
+        finally:
+            for ticket in batch:
+                ticket.done.set()
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    """The process-wide coalescer, or None when STATUS_WRITE_COALESCER is disabled"""
+    global _coalescer
+    config = getattr(settings, 'STATUS_WRITE_COALESCER', {})
+    if not config.get('ENABLED'):
+        return None
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = StatusWriteCoalescer(
+                max_delay_ms=config.get('MAX_DELAY_MS', 5),
+                max_batch=config.get('MAX_BATCH', 200),
+                timeout=config.get('TIMEOUT', 10),
+            )
+    return _coalescer
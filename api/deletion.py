@@ -0,0 +1,184 @@
+"""
+Chunked deletion of a category (with its tasks, subtasks, serials and
+statuses) or of a batch of product serials.
+
+Django's cascade collector loads every related row and deletes everything in
+one long transaction, which holds SQLite's writer lock for minutes. Here the
+root rows, and the product serials under a category, are flagged `deleting`
+straight away (so the API hides them and no read recreates their status rows
+mid-job) and the descendants are removed bottom-up with raw DELETEs of at most
+DELETION_CHUNK_SIZE rows, each in its own short transaction, pausing between
+chunks so station traffic can take the lock. Progress is kept on the
+DeletionJob row.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import catalogue, rollups
+from .routers import current_database, is_partitioned, partition_databases, use_database
+from .models import (
+    ProductCategory,
+    Task,
+    SubTask,
+    ProductSerial,
+    SerialSubTaskStatus,
+    StatusResult,
+    StatusRollup,
+    DeletionJob
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _chunk_size():
+    return getattr(settings, 'DELETION_CHUNK_SIZE', 500)
+
+
+def _pause():
+    return getattr(settings, 'DELETION_CHUNK_PAUSE', 0.05)
+
+
+# ------------------------------
+# What to delete, children first
+# ------------------------------
+def category_serials(category_id):
+    """Serials of the category, or pointing at one of its subtasks"""
+    return ProductSerial.objects.filter(Q(product_id=category_id) | Q(subtask__task__category_id=category_id))
+
+
+def category_steps(category_id):
+    subtasks = Q(subtask__task__category_id=category_id)
+    return [
+        ('status results', StatusResult.objects.filter(
+            subtasks | Q(serial_no__in=category_serials(category_id).values('serial_no'))
+        )),
+        ('subtask statuses', SerialSubTaskStatus.objects.filter(
+            Q(product_serial__product_id=category_id)
+            | Q(category_id=category_id)
+            | Q(product_serial__subtask__task__category_id=category_id)
+        )),
+        ('status rollups', StatusRollup.objects.filter(subtasks)),
+        ('product serials', category_serials(category_id)),
+        ('subtasks', SubTask.objects.filter(task__category_id=category_id)),
+        ('tasks', Task.objects.filter(category_id=category_id)),
+        ('category', ProductCategory.objects.filter(id=category_id)),
+    ]
+
+
+def serial_steps(serial_nos):
+    return [
+        ('status results', StatusResult.objects.filter(serial_no__in=serial_nos)),
+        ('subtask statuses', SerialSubTaskStatus.objects.filter(product_serial_id__in=serial_nos)),
+        ('product serials', ProductSerial.objects.filter(serial_no__in=serial_nos)),
+    ]
+
+
+# ------------------------------
+# Job lifecycle
+# ------------------------------
+def create_job(kind, target):
+    """
+    Flag the root rows (and a category's serials) as deleting and queue the job; runs it once the
+    caller's transaction commits. Serial jobs remember the current plant database.
+    """
+    with transaction.atomic():
+        if kind == 'category':
+            ProductCategory.objects.filter(id=target).update(deleting=True)
+            catalogue.schedule_refresh()
+            for alias in partition_databases():
+                category_serials(target).using(alias).update(deleting=True)
+        else:
+            ProductSerial.objects.filter(serial_no__in=target).update(deleting=True)
+        job = DeletionJob.objects.create(kind=kind, target=target, database=current_database())
+        transaction.on_commit(lambda: start_job(job.pk))
+    return job
+
+
+def start_job(job_id):
+    if getattr(settings, 'DELETION_IN_BACKGROUND', True):
+        threading.Thread(target=_run_in_thread, args=(job_id,), daemon=True).start()
+    else:
+        run_job(job_id)
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        for conn in connections.all(initialized_only=True):
+            conn.close()
+
+
+def _delete_chunks(job, queryset):
+    """Raw-delete `queryset` in primary-key order, one short transaction per chunk"""
+    model = queryset.model
+    last_pk = None
+    while True:
+        pending = queryset.order_by('pk')
+        if last_pk is not None:
+            pending = pending.filter(pk__gt=last_pk)
+        ids = list(pending.values_list('pk', flat=True)[:_chunk_size()])
+        if not ids:
+            return
+
+        with transaction.atomic(using=queryset.db):
+            chunk = model.objects.using(queryset.db).filter(pk__in=ids)
+            if model is StatusResult:
+                # Take the removed results out of the hourly / daily rollups as well
+                rollups.take_back(chunk)
+            deleted = chunk._raw_delete(chunk.db)
+            DeletionJob.objects.filter(pk=job.pk).update(deleted_rows=F('deleted_rows') + deleted)
+
+        last_pk = ids[-1]
+        time.sleep(_pause())
+
+
+def _job_steps(job):
+    """(name, queryset) pairs bound to a database: serial / status steps run on every plant database
+    for a category, catalogue steps on 'default'"""
+    if job.kind != 'category':
+        return [(name, qs.using(job.database)) for name, qs in serial_steps(job.target)]
+    steps = []
+    for name, queryset in category_steps(job.target):
+        if is_partitioned(queryset.model):
+            steps.extend((name, queryset.using(alias)) for alias in partition_databases())
+        else:
+            steps.append((name, queryset.using(DEFAULT_DB_ALIAS)))
+    return steps
+
+
+def run_job(job_id):
+    job = DeletionJob.objects.get(pk=job_id)
+    steps = _job_steps(job)
+
+    DeletionJob.objects.filter(pk=job.pk).update(
+        status='running', total_rows=job.deleted_rows + sum(qs.count() for _, qs in steps)
+    )
+    try:
+        for name, queryset in steps:
+            DeletionJob.objects.filter(pk=job.pk).update(step=name)
+            with use_database(queryset.db):
+                _delete_chunks(job, queryset)
+    except Exception as exc:
+        logger.exception("Deletion job %s failed", job.pk)
+        DeletionJob.objects.filter(pk=job.pk).update(status='failed', error=str(exc), finished_at=timezone.now())
+        return
+
+    DeletionJob.objects.filter(pk=job.pk).update(status='done', step='', finished_at=timezone.now())
+    if job.kind == 'category':
+        # Raw deletes send no signals
+        catalogue.refresh_snapshot()
+
+
+def resume_unfinished():
+    """Run jobs left queued / running / failed, e.g. after a worker restart"""
+    job_ids = list(DeletionJob.objects.exclude(status='done').order_by('id').values_list('id', flat=True))
+    for job_id in job_ids:
+        run_job(job_id)
+    return job_ids
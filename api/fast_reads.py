@@ -0,0 +1,100 @@
+"""
+Read paths for the hot GET endpoints that skip model instances and DRF field
+machinery: the needed columns come from one `.values_list()` join and are
+turned into plain dicts with exactly the keys and formatting of the matching
+serializer (see the equivalence tests in tests.py).
+"""
+from collections import defaultdict
+
+from rest_framework import serializers
+
+from .models import ProductSerial
+
+_datetime = serializers.DateTimeField()
+
+
+def _format_datetime(value):
+    return None if value is None else _datetime.to_representation(value)
+
+
+# ------------------------------
+# Same output as ProductSerialSerializer
+# ------------------------------
+PRODUCT_SERIAL_COLUMNS = (
+    'serial_no', 'product_id', 'product__name', 'status', 'subtask_id', 'subtask__name', 'priority',
+)
+
+
+def _product_serial_dict(row):
+    serial_no, product_id, product_name, status, subtask_id, subtask_name, priority = row
+    data = {
+        'serial_no': serial_no,
+        'product': product_id,
+        'product_name': product_name,
+        'status': status,
+        'subtask': subtask_id,
+        'subtask_name': subtask_name,
+        'priority': priority,
+    }
+    # The serializer skips `subtask.name` entirely when there is no subtask
+    if subtask_id is None:
+        del data['subtask_name']
+    return data
+
+
+def product_serials(queryset):
+    return [_product_serial_dict(row) for row in queryset.values_list(*PRODUCT_SERIAL_COLUMNS)]
+
+
+# ------------------------------
+# Same output as SubTaskSerializer (with nested product_serials)
+# ------------------------------
+def subtasks(queryset):
+    rows = list(queryset.values_list('id', 'name', 'description', 'task_id', 'task__name', 'status'))
+
+    serials_by_subtask = defaultdict(list)
+    serial_rows = ProductSerial.objects.filter(
+        subtask_id__in=[row[0] for row in rows], deleting=False
+    ).values_list(*PRODUCT_SERIAL_COLUMNS)
+    for row in serial_rows:
+        serials_by_subtask[row[4]].append(_product_serial_dict(row))
+
+    return [
+        {
+            'id': subtask_id,
+            'name': name,
+            'description': description,
+            'task': task_id,
+            'task_name': task_name,
+            'status': status,
+            'product_serials': serials_by_subtask[subtask_id],
+        }
+        for subtask_id, name, description, task_id, task_name, status in rows
+    ]
+
+
+# ------------------------------
+# Same output as SerialSubTaskStatusSerializer
+# ------------------------------
+def serial_statuses(queryset):
+    rows = queryset.values_list(
+        'id', 'product_serial_id', 'product_serial__product__name', 'task_id', 'subtask__task__name',
+        'subtask_id', 'subtask__name', 'status', 'updated_by', 'remark', 'update_time',
+    )
+    return [
+        {
+            'id': status_id,
+            'serial_no': serial_no,
+            'product_name': product_name,
+            'task_id': task_id,
+            'task_name': task_name,
+            'subtask': subtask_id,
+            'subtask_name': subtask_name,
+            'status': status,
+            'updated_by': updated_by,
+            'remark': remark,
+            'update_time': _format_datetime(update_time),
+        }
+        for (status_id, serial_no, product_name, task_id, task_name,
+             subtask_id, subtask_name, status, updated_by, remark, update_time) in rows
+    ]
@@ -0,0 +1,20 @@
+import django_filters
+
+from .models import SerialSubTaskStatus
+
+
+# ------------------------------
+# SerialSubTaskStatus Filters
+# ------------------------------
+class SerialSubTaskStatusFilter(django_filters.FilterSet):
+    """
+    e.g. /api/serial-statuses/?status=Not_OK&task=3&update_time_after=2025-10-23
+    """
+    serial_no = django_filters.CharFilter(field_name='product_serial')
+    category = django_filters.NumberFilter(field_name='category')
+    task = django_filters.NumberFilter(field_name='task')
+    update_time = django_filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = SerialSubTaskStatus
+        fields = ['status', 'subtask', 'updated_by']
@@ -0,0 +1,123 @@
+import hashlib
+import json
+from contextlib import nullcontext
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import coalescer
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def _pending_timeout():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_PENDING_TIMEOUT', 60))
+
+
+def _request_hash(request):
+    """Fingerprint of the request body, so a reused key with a different payload is rejected"""
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _existing_key_response(stored, request_hash):
+    """Response for a request whose key is already taken: a replay, or why it can't be one"""
+    if stored['request_hash'] != request_hash:
+        return Response(
+            {"error": f"{IDEMPOTENCY_HEADER} was already used with a different request body"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if stored['status_code'] is None:
+        response = Response(
+            {"error": f"A request with this {IDEMPOTENCY_HEADER} is still being processed"},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Retry-After'] = '1'
+        return response
+    response = Response(stored['response_body'], status=stored['status_code'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Wrap an APIView handler so a request carrying an `Idempotency-Key` header
+    is executed once: the key is reserved before the view runs, the response is
+    stored with it, and replays within the TTL get the stored response back
+    without touching the tables again. A retry that arrives while the first
+    request is still running gets 409.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > 255:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} must be at most 255 characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        endpoint = request.path[:100]
+        request_hash = _request_hash(request)
+        now = timezone.now()
+        cutoff = now - _ttl()
+        abandoned = now - _pending_timeout()
+        fields = ('request_hash', 'status_code', 'response_body', 'created_at')
+
+        # ✅ Replay: a single indexed read, no writes
+        stored = IdempotencyKey.objects.filter(
+            endpoint=endpoint, key=key, created_at__gte=cutoff
+        ).values(*fields).first()
+        if stored and not (stored['status_code'] is None and stored['created_at'] < abandoned):
+            return _existing_key_response(stored, request_hash)
+
+        # Reserve the key before running the view; the unique (endpoint, key) constraint
+        # lets only one of several concurrent requests with the same key through
+        database = router.db_for_write(IdempotencyKey)
+        IdempotencyKey.objects.filter(
+            Q(created_at__lt=cutoff)
+            | Q(endpoint=endpoint, key=key, status_code__isnull=True, created_at__lt=abandoned)
+        ).delete()
+        try:
+            with transaction.atomic(using=database):
+                reservation = IdempotencyKey.objects.create(
+                    endpoint=endpoint, key=key, request_hash=request_hash, created_at=now
+                )
+        except IntegrityError:
+            stored = IdempotencyKey.objects.filter(endpoint=endpoint, key=key).values(*fields).first()
+            return _existing_key_response(stored, request_hash)
+        reserved = IdempotencyKey.objects.filter(pk=reservation.pk, status_code__isnull=True)
+
+        # The view's writes and the stored response commit together, so a crash in between can't
+        # leave writes a retry would redo. Views whose writes go through the coalescer (coalescer.py)
+        # run outside the transaction instead: the coalescer commits from its own thread while they wait.
+        coalesced = getattr(self, 'coalesced_writes', False) and coalescer.get_coalescer() is not None
+        try:
+            with nullcontext() if coalesced else transaction.atomic(using=database):
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    reserved.update(status_code=response.status_code, response_body=response.data)
+        except Exception:
+            reserved.delete()
+            raise
+
+        # Server errors are not stored so the client can retry them
+        if response.status_code >= 500:
+            reserved.delete()
+        return response
+
+    return wrapper
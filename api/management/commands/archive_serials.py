@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import (
+    ProductSerial,
+    SerialSubTaskStatus,
+    ArchivedProductSerial,
+    ArchivedSerialSubTaskStatus
+)
+from api.routers import partition_databases, use_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Move completed product serials (and their subtask statuses) whose last "
+        "update is older than the cutoff into the archive tables, in every plant database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help="Archive serials whose last status update is older than this many days")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Serials moved per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many serials would be archived")
+        vacuum = parser.add_mutually_exclusive_group()
+        vacuum.add_argument('--skip-vacuum', action='store_true',
+                            help="Do not run incremental VACUUM / ANALYZE afterwards")
+        vacuum.add_argument('--enable-incremental', action='store_true',
+                            help="Switch the database to auto_vacuum=INCREMENTAL first if it isn't yet. "
+                                 "Runs one full VACUUM, which locks the database while it rewrites the file")
+
+    def handle(self, *args, **options):
+        for database in partition_databases():
+            self.stdout.write(f"Database '{database}':")
+            with use_database(database):
+                self.archive(database, options)
+
+    def archive(self, database, options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        chunk_size = options['chunk_size']
+
+        serial_nos = list(
+            ProductSerial.objects.filter(status='completed')
+            .annotate(last_update=Max('serial_subtasks__update_time'))
+            .filter(last_update__lt=cutoff)
+            .order_by('serial_no')
+            .values_list('serial_no', flat=True)
+        )
+        self.stdout.write(f"{len(serial_nos)} completed serial(s) last updated before {cutoff:%Y-%m-%d}")
+        if options['dry_run']:
+            return
+
+        moved_serials = moved_statuses = 0
+        for start in range(0, len(serial_nos), chunk_size):
+            chunk = serial_nos[start:start + chunk_size]
+            serials, statuses = self.archive_chunk(database, chunk)
+            moved_serials += serials
+            moved_statuses += statuses
+            self.stdout.write(f"  archived {moved_serials}/{len(serial_nos)} serials ({moved_statuses} statuses)")
+
+        if not options['skip_vacuum'] and (serial_nos or options['enable_incremental']):
+            self.vacuum(database, options['enable_incremental'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved_serials} serials and {moved_statuses} subtask statuses"
+        ))
+
+    def archive_chunk(self, database, serial_nos):
+        """Copy one chunk into the archive and delete it from the live tables in a single short transaction"""
+        now = timezone.now()
+        with transaction.atomic(using=database):
+            serials = list(
+                ProductSerial.objects.filter(serial_no__in=serial_nos, status='completed')
+                .select_related('product')
+            )
+            live = [s.serial_no for s in serials]
+            statuses = list(
+                SerialSubTaskStatus.objects.filter(product_serial_id__in=live)
+                .select_related('subtask__task')
+            )
+
+            # Rows a previous, interrupted run already copied are left as they are and not counted again
+            archived_serials = set(
+                ArchivedProductSerial.objects.filter(serial_no__in=live).values_list('serial_no', flat=True)
+            )
+            archived_statuses = set(
+                ArchivedSerialSubTaskStatus.objects.filter(product_serial_id__in=live).values_list('id', flat=True)
+            )
+            serials = [s for s in serials if s.serial_no not in archived_serials]
+            statuses = [st for st in statuses if st.id not in archived_statuses]
+
+            ArchivedProductSerial.objects.bulk_create([
+                ArchivedProductSerial(
+                    serial_no=s.serial_no,
+                    product_id=s.product_id,
+                    category_name=s.product.name,
+                    product_name=s.product_name,
+                    status=s.status,
+                    subtask_id=s.subtask_id,
+                    archived_at=now,
+                ) for s in serials
+            ], ignore_conflicts=True)
+            ArchivedSerialSubTaskStatus.objects.bulk_create([
+                ArchivedSerialSubTaskStatus(
+                    id=st.id,
+                    product_serial_id=st.product_serial_id,
+                    subtask_id=st.subtask_id,
+                    subtask_name=st.subtask.name,
+                    task_id=st.subtask.task_id,
+                    task_name=st.subtask.task.name,
+                    status=st.status,
+                    first_status=st.first_status,
+                    remark=st.remark,
+                    updated_by=st.updated_by,
+                    update_time=st.update_time,
+                ) for st in statuses
+            ], ignore_conflicts=True)
+
+            SerialSubTaskStatus.objects.filter(product_serial_id__in=live).delete()
+            ProductSerial.objects.filter(serial_no__in=live).delete()
+
+        return len(serials), len(statuses)
+
+    def vacuum(self, database, enable_incremental=False):
+        connection = connections[database]
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA auto_vacuum")
+            mode = cursor.fetchone()[0]
+            if mode != 2 and enable_incremental:
+                # An existing database only changes auto_vacuum mode when VACUUM rebuilds it
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                cursor.execute("VACUUM")
+                cursor.execute("PRAGMA auto_vacuum")
+                mode = cursor.fetchone()[0]
+                self.stdout.write("  auto_vacuum set to INCREMENTAL (full vacuum done)")
+            if mode == 2:
+                # Only incremental mode can hand pages back without a full, locking VACUUM
+                cursor.execute("PRAGMA incremental_vacuum")
+                self.stdout.write("  incremental vacuum done")
+            else:
+                self.stdout.write("  auto_vacuum is not INCREMENTAL; freed pages will be reused but not released "
+                                  "(see --enable-incremental)")
+            for table in (ProductSerial, SerialSubTaskStatus, ArchivedProductSerial, ArchivedSerialSubTaskStatus):
+                cursor.execute(f'ANALYZE "{table._meta.db_table}"')
+        self.stdout.write("  analyze done")
@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.backup import prune, snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Back up the SQLite databases while the API keeps running, using SQLite's online backup API "
+        "in small page steps. e.g. backup_db --gzip --checksum --interval 3600 --keep 48"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='databases',
+                            help="Database alias to back up (repeatable; default: all SQLite databases)")
+        parser.add_argument('--output-dir', default=settings.BACKUP_DIR)
+        parser.add_argument('--pages', type=int, default=256, help="Pages copied per step")
+        parser.add_argument('--sleep', type=float, default=0.05, help="Pause between steps (seconds)")
+        parser.add_argument('--max-restarts', type=int, default=5,
+                            help="Restarts caused by concurrent writes before copying the rest in one step")
+        parser.add_argument('--gzip', action='store_true', help="Compress the backup")
+        parser.add_argument('--checksum', action='store_true', help="Write a .sha256 file next to each backup")
+        parser.add_argument('--verify', action='store_true', help="Run PRAGMA quick_check on the copy")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep running and take a snapshot every INTERVAL seconds")
+        parser.add_argument('--keep', type=int, default=0,
+                            help="Keep only the newest KEEP backups per database (0 keeps all)")
+
+    def sources(self, aliases):
+        sources = {}
+        for alias in aliases or list(connections):
+            if alias not in connections:
+                raise CommandError(f"Unknown database '{alias}'")
+            config = connections[alias].settings_dict
+            name = str(config['NAME'])
+            if config['ENGINE'] != 'django.db.backends.sqlite3' or name == ':memory:' or 'mode=memory' in name:
+                if aliases:
+                    raise CommandError(f"'{alias}' is not an SQLite file database")
+                continue
+            sources[alias] = name
+        return sources
+
+    def handle(self, *args, **options):
+        sources = self.sources(options['databases'])
+        while True:
+            started = time.monotonic()
+            for alias, path in sources.items():
+                self.back_up(alias, path, options)
+            if not options['interval']:
+                return
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+
+    def back_up(self, alias, path, options):
+        started = time.monotonic()
+        target = snapshot(
+            path, options['output_dir'], alias,
+            compress=options['gzip'], checksum=options['checksum'], verify=options['verify'],
+            pages=options['pages'], sleep=options['sleep'], max_restarts=options['max_restarts'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{alias}: {target} ({target.stat().st_size / 1e6:.1f} MB, {time.monotonic() - started:.1f}s)"
+        ))
+        for removed in prune(options['output_dir'], alias, options['keep']):
+            self.stdout.write(f"  removed {removed.name}")
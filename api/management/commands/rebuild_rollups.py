@@ -0,0 +1,75 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.models import SubTask, StatusResult, StatusRollup
+from api.rollups import COUNTERS
+from api.routers import partition_databases, use_database
+
+TRUNCATE = {'hour': TruncHour, 'day': TruncDay}
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the hourly / daily StatusRollup rows from the logged results (StatusResult) "
+        "in every plant database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only rebuild buckets from this date (YYYY-MM-DD) onwards")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            day = parse_date(options['since'])
+            if day is None:
+                raise CommandError("--since must be a date in YYYY-MM-DD format")
+            since = timezone.make_aware(datetime.combine(day, time.min))
+
+        subtask_ids = set(SubTask.objects.values_list('id', flat=True))
+        for database in partition_databases():
+            with use_database(database):
+                self.rebuild(database, since, subtask_ids, options['batch_size'])
+
+    def rebuild(self, database, since, subtask_ids, batch_size):
+        with transaction.atomic(using=database):
+            stale = StatusRollup.objects.all()
+            if since:
+                stale = stale.filter(bucket__gte=since)
+            deleted, _ = stale.delete()
+
+            results = StatusResult.objects.all()
+            if since:
+                results = results.filter(recorded_at__gte=since)
+            rows = []
+            for granularity, trunc in TRUNCATE.items():
+                grouped = (
+                    results.annotate(bucket=trunc('recorded_at'))
+                    .values('bucket', 'subtask_id')
+                    .annotate(
+                        ok_count=Count('id', filter=Q(status='OK')),
+                        not_ok_count=Count('id', filter=Q(status='Not_OK')),
+                        first_ok_count=Count('id', filter=Q(status='OK', first=True)),
+                        first_not_ok_count=Count('id', filter=Q(status='Not_OK', first=True)),
+                    )
+                    .order_by()
+                )
+                rows.extend(
+                    StatusRollup(granularity=granularity, bucket=row['bucket'], subtask_id=row['subtask_id'],
+                                 **{counter: row[counter] for counter in COUNTERS})
+                    for row in grouped
+                    # Plant copies of the catalogue may lag behind; skip results of subtasks they lack
+                    if row['subtask_id'] in subtask_ids and any(row[counter] for counter in COUNTERS)
+                )
+
+            StatusRollup.objects.bulk_create(rows, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Replaced {deleted} rollup rows with {len(rows)} in '{database}'"
+        ))
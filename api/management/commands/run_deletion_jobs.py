@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.deletion import resume_unfinished
+
+
+class Command(BaseCommand):
+    help = "Finish chunked deletion jobs that were interrupted (queued, running or failed)."
+
+    def handle(self, *args, **options):
+        job_ids = resume_unfinished()
+        self.stdout.write(self.style.SUCCESS(f"Ran {len(job_ids)} deletion job(s)"))
@@ -0,0 +1,106 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from api.catalogue import sync_replicas
+from api.models import (
+    ProductCategory,
+    ProductSerial,
+    SerialSubTaskStatus,
+    ArchivedProductSerial,
+    ArchivedSerialSubTaskStatus,
+    StatusResult,
+)
+from api.routers import plant_databases
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the product serials (live and archived, with their subtask statuses) of the given "
+        "categories from the default database into a plant database, then rebuild the rollups. "
+        "e.g. split_plants --assign north=1,2 --assign south=3"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assign', action='append', default=[], metavar='PLANT=CATEGORY_IDS',
+                            help="Plant (from PQC_PLANTS) and comma-separated category ids to move there")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Serials moved per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many serials would be moved")
+
+    def parse_assignments(self, values):
+        plants = plant_databases()
+        if not values:
+            raise CommandError("Give at least one --assign PLANT=CATEGORY_IDS")
+        assignments = []
+        for value in values:
+            plant, _, ids = value.partition('=')
+            if plant not in plants:
+                raise CommandError(f"Unknown plant '{plant}'; configured plants: {sorted(plants)}")
+            try:
+                category_ids = [int(i) for i in ids.split(',') if i.strip()]
+            except ValueError:
+                raise CommandError(f"Category ids must be integers: '{ids}'")
+            missing = set(category_ids) - set(ProductCategory.objects.filter(id__in=category_ids).values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown category ids: {sorted(missing)}")
+            assignments.append((plant, plants[plant], category_ids))
+        return assignments
+
+    def handle(self, *args, **options):
+        assignments = self.parse_assignments(options['assign'])
+        chunk_size = options['chunk_size']
+
+        for plant, database, category_ids in assignments:
+            live = list(
+                ProductSerial.objects.using(DEFAULT_DB_ALIAS).filter(product_id__in=category_ids)
+                .order_by('serial_no').values_list('serial_no', flat=True)
+            )
+            archived = list(
+                ArchivedProductSerial.objects.using(DEFAULT_DB_ALIAS).filter(product_id__in=category_ids)
+                .order_by('serial_no').values_list('serial_no', flat=True)
+            )
+            self.stdout.write(
+                f"{plant}: {len(live)} live and {len(archived)} archived serial(s) of categories {category_ids}"
+            )
+            if options['dry_run']:
+                continue
+
+            call_command('migrate', database=database, verbosity=0)
+            sync_replicas()
+            for serials, statuses, serial_nos in (
+                (ProductSerial, SerialSubTaskStatus, live),
+                (ArchivedProductSerial, ArchivedSerialSubTaskStatus, archived),
+            ):
+                for start in range(0, len(serial_nos), chunk_size):
+                    self.move_chunk(serials, statuses, serial_nos[start:start + chunk_size], database)
+                    self.stdout.write(f"  moved {min(start + chunk_size, len(serial_nos))}/{len(serial_nos)} "
+                                      f"{serials._meta.verbose_name_plural}")
+
+        if not options['dry_run']:
+            # Rollups follow the statuses into their new databases
+            call_command('rebuild_rollups', stdout=self.stdout)
+            self.stdout.write(self.style.SUCCESS("Split complete"))
+
+    def move_chunk(self, serials, statuses, serial_nos, database):
+        """
+        Copy one chunk into `database`, then delete it from 'default'. The copy ignores rows
+        that are already there, so an interrupted run can simply be repeated.
+        """
+        with transaction.atomic(using=database):
+            serials.objects.using(database).bulk_create(
+                serials.objects.using(DEFAULT_DB_ALIAS).filter(serial_no__in=serial_nos), ignore_conflicts=True
+            )
+            statuses.objects.using(database).bulk_create(
+                statuses.objects.using(DEFAULT_DB_ALIAS).filter(product_serial_id__in=serial_nos),
+                ignore_conflicts=True,
+            )
+            StatusResult.objects.using(database).bulk_create(
+                StatusResult.objects.using(DEFAULT_DB_ALIAS).filter(serial_no__in=serial_nos),
+                ignore_conflicts=True,
+            )
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            for model, field in ((StatusResult, 'serial_no'), (statuses, 'product_serial_id'), (serials, 'serial_no')):
+                rows = model.objects.using(DEFAULT_DB_ALIAS).filter(**{f'{field}__in': serial_nos})
+                rows._raw_delete(DEFAULT_DB_ALIAS)
@@ -0,0 +1,109 @@
+"""
+Prometheus metrics, served in the text format at /metrics.
+
+The collectors are plain prometheus_client metrics updated in-process:
+
+- MetricsMiddleware: requests and latency per view (URL name), method and status
+- an execute_wrapper added to every database connection when it is opened:
+  query counts and durations per database and read / write, and statements
+  that failed because SQLite stayed locked past the busy timeout. Python's
+  sqlite3 doesn't expose the busy handler, so time spent waiting for the
+  write lock shows up in the write-query durations.
+- rollups.apply_changes(): status changes by new status, counted on commit
+- catalogue.cached_diff(): diff cache hits and misses
+
+Under gunicorn each worker writes its values to files in
+PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) and /metrics adds up the
+files of all workers, so a scrape sees the whole server whichever worker
+answers it. Without that variable the metrics of the current process are served.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+from .models import SerialSubTaskStatus
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER')
+STATUSES = {value for value, _ in SerialSubTaskStatus.STATUS_CHOICES}
+
+REQUESTS = Counter(
+    'pqc_http_requests_total', "HTTP requests by view, method and status code", ['view', 'method', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'pqc_http_request_duration_seconds', "HTTP request latency by view and method", ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Counter(
+    'pqc_db_queries_total', "SQL statements by database and read / write", ['database', 'operation'],
+)
+DB_QUERY_DURATION = Histogram(
+    'pqc_db_query_duration_seconds', "SQL statement duration by database and read / write (writes include lock waits)",
+    ['database', 'operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5),
+)
+DB_BUSY = Counter(
+    'pqc_db_busy_errors_total', "Statements that failed because the SQLite database stayed locked", ['database'],
+)
+STATUS_UPDATES = Counter(
+    'pqc_status_updates_total', "Committed subtask status changes by new status", ['status'],
+)
+CACHE_REQUESTS = Counter(
+    'pqc_cache_requests_total', "Cache lookups by cache and hit / miss", ['cache', 'result'],
+)
+
+
+def _operation(sql):
+    return 'write' if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS) else 'read'
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper added to every connection as it is opened (signals.py)"""
+    database = context['connection'].alias
+    operation = _operation(sql)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    except Exception as exc:
+        message = str(exc).lower()
+        if 'locked' in message or 'busy' in message:
+            DB_BUSY.labels(database).inc()
+        raise
+    finally:
+        DB_QUERIES.labels(database, operation).inc()
+        DB_QUERY_DURATION.labels(database, operation).observe(time.perf_counter() - started)
+
+
+def track_connection(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def record_status_updates(counts, using):
+    """Count `{status: rows}` once the transaction writing them commits"""
+    def record():
+        for value, count in counts.items():
+            STATUS_UPDATES.labels(value if value in STATUSES else 'other').inc(count)
+    transaction.on_commit(record, using=using)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def config():
+    return {'TOKEN': '', **getattr(settings, 'METRICS', {})}
+
+
+def render():
+    """(body, content type) of a scrape"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,83 @@
+import random
+import time
+
+from django.http import JsonResponse
+
+from . import metrics, profiling
+from .routers import plant_databases, use_database
+
+PLANT_HEADER = 'X-Plant'
+PLANT_PARAM = 'plant'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+
+
+class MetricsMiddleware:
+    """Request counts and latency per view for /metrics (see metrics.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.REQUESTS.labels(view, request.method, response.status_code).inc()
+        metrics.REQUEST_DURATION.labels(view, request.method).observe(time.perf_counter() - started)
+        return response
+
+
+class PlantMiddleware:
+    """Route the request's serial / status queries to its plant's database (see routers.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        plant = request.headers.get(PLANT_HEADER) or request.GET.get(PLANT_PARAM)
+        if not plant:
+            return self.get_response(request)
+
+        alias = plant_databases().get(plant)
+        if alias is None:
+            return JsonResponse({"error": f"Unknown plant '{plant}'"}, status=400)
+
+        if PLANT_PARAM in request.GET:
+            # Keep ?plant= away from filters and the admin changelist
+            request.GET = request.GET.copy()
+            del request.GET[PLANT_PARAM]
+
+        with use_database(alias):
+            return self.get_response(request)
+
+
+class ProfilingMiddleware:
+    """Staff-requested (?_profile=cpu|mem, X-Profile header) and sampled request profiles (see profiling.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        if PROFILE_PARAM in request.GET:
+            request.GET = request.GET.copy()
+            del request.GET[PROFILE_PARAM]
+
+        if requested and request.user.is_staff:
+            if requested not in profiling.KINDS:
+                return JsonResponse({"error": f"{PROFILE_PARAM} must be one of {list(profiling.KINDS)}"}, status=400)
+            response, summary, profiler = profiling.profile_request(request, self.get_response, requested)
+            profiling.store(summary, profiler)
+            response['X-Profile-Id'] = summary['id']
+            response['X-Profile-Duration-Ms'] = str(summary['duration_ms'])
+            response['X-Profile-Queries'] = str(summary['query_count'])
+            response['X-Profile-SQL-Ms'] = str(summary['sql_ms'])
+            return response
+
+        if random.random() < profiling.config()['SAMPLE_RATE']:
+            response, summary, profiler = profiling.profile_request(request, self.get_response, 'cpu')
+            profiling.store(summary, profiler)
+            return response
+
+        return self.get_response(request)
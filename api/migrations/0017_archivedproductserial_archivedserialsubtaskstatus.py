@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedProductSerial',
+            fields=[
+                ('serial_no', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('product_id', models.BigIntegerField(db_index=True)),
+                ('category_name', models.CharField(max_length=100)),
+                ('product_name', models.CharField(max_length=100)),
+                ('status', models.CharField(max_length=10)),
+                ('subtask_id', models.BigIntegerField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedSerialSubTaskStatus',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('subtask_id', models.BigIntegerField()),
+                ('subtask_name', models.CharField(max_length=100)),
+                ('task_id', models.BigIntegerField()),
+                ('task_name', models.CharField(max_length=100)),
+                ('status', models.CharField(max_length=10)),
+                ('remark', models.TextField(blank=True, null=True)),
+                ('updated_by', models.CharField(blank=True, max_length=150, null=True)),
+                ('update_time', models.DateTimeField(blank=True, null=True)),
+                ('product_serial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='serial_subtasks', to='api.archivedproductserial')),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_archivedproductserial_archivedserialsubtaskstatus'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='serialsubtaskstatus',
+            index=models.Index(fields=['status', 'update_time'], name='api_serials_status_919237_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serialsubtaskstatus',
+            index=models.Index(fields=['update_time'], name='api_serials_update__a63a3f_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_first_status(apps, schema_editor):
+    # History is not recorded, so the current result is the best guess for the first one.
+    # Each plant database migrates its own status tables (live and archived); fill in that copy
+    db = schema_editor.connection.alias
+    for name in ('SerialSubTaskStatus', 'ArchivedSerialSubTaskStatus'):
+        model = apps.get_model('api', name)
+        model.objects.using(db).exclude(status='pending').update(first_status=F('status'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_serialsubtaskstatus_status_update_time_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedserialsubtaskstatus',
+            name='first_status',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='serialsubtaskstatus',
+            name='first_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('OK', 'OK'), ('Not_OK', 'Not OK')], max_length=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='StatusRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('ok_count', models.IntegerField(default=0)),
+                ('not_ok_count', models.IntegerField(default=0)),
+                ('first_ok_count', models.IntegerField(default=0)),
+                ('first_not_ok_count', models.IntegerField(default=0)),
+                ('subtask', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_rollups', to='api.subtask')),
+            ],
+            options={
+                'unique_together': {('granularity', 'bucket', 'subtask')},
+            },
+        ),
+        migrations.RunPython(backfill_first_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_status_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productserial',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='productserial',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='productserial',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productserial',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='productserial',
+            index=models.Index(fields=['status', '-priority', 'created_at'], name='api_product_status_39cc8c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productserial',
+            index=models.Index(fields=['status', 'created_at'], name='api_product_status_ccdb30_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productserial',
+            index=models.Index(fields=['lease_expires'], name='api_product_lease_e_467dc4_idx'),
+        ),
+    ]
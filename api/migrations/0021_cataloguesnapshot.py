@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_productserial_work_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueSnapshot',
+            fields=[
+                ('version', models.BigAutoField(primary_key=True, serialize=False)),
+                ('checksum', models.CharField(max_length=64)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_cataloguesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('category', 'Category'), ('serials', 'Product Serials')], max_length=10)),
+                ('target', models.JSONField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('step', models.CharField(blank=True, max_length=50)),
+                ('total_rows', models.IntegerField(blank=True, null=True)),
+                ('deleted_rows', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='productserial',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:23
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_task_category(apps, schema_editor):
+    # Batches of primary keys, each in its own short transaction, so a large table doesn't hold the write lock
+    # The rows and the subtask subquery both use the database being migrated: a plant's statuses point at
+    # its own replica of the catalogue
+    db = schema_editor.connection.alias
+    SerialSubTaskStatus = apps.get_model('api', 'SerialSubTaskStatus')
+    SubTask = apps.get_model('api', 'SubTask')
+    subtask = SubTask.objects.using(db).filter(pk=OuterRef('subtask_id'))
+
+    last_pk = SerialSubTaskStatus.objects.using(db).order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_pk + 1, BATCH_SIZE):
+        with transaction.atomic(using=db):
+            SerialSubTaskStatus.objects.using(db).filter(pk__gte=start, pk__lt=start + BATCH_SIZE).update(
+                task_id=Subquery(subtask.values('task_id')),
+                category_id=Subquery(subtask.values('task__category_id')),
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0022_deletion_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serialsubtaskstatus',
+            name='category',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.productcategory'),
+        ),
+        migrations.AddField(
+            model_name='serialsubtaskstatus',
+            name='task',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.task'),
+        ),
+        # Fill the columns before building the indexes on them
+        migrations.RunPython(backfill_task_category, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='serialsubtaskstatus',
+            index=models.Index(fields=['category', 'status', 'update_time'], name='api_serials_categor_b130a8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serialsubtaskstatus',
+            index=models.Index(fields=['task', 'status', 'update_time'], name='api_serials_task_id_932ba7_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_serialsubtaskstatus_task_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deletionjob',
+            name='database',
+            field=models.CharField(default='default', max_length=50),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDay, TruncHour
+
+RESULTS = ('OK', 'Not_OK')
+BATCH_SIZE = 5000
+
+
+def backfill_results(apps, schema_editor):
+    # Only the first and the latest result of each check are known: log those (a reworked check
+    # gets both, at its update_time), then recount the rollups from the log
+    db = schema_editor.connection.alias
+    StatusResult = apps.get_model('api', 'StatusResult')
+    StatusRollup = apps.get_model('api', 'StatusRollup')
+    subtask_ids = set(apps.get_model('api', 'SubTask').objects.using(db).values_list('id', flat=True))
+
+    batch = []
+    for name in ('SerialSubTaskStatus', 'ArchivedSerialSubTaskStatus'):
+        rows = apps.get_model('api', name).objects.using(db).filter(update_time__isnull=False).values_list(
+            'product_serial_id', 'subtask_id', 'update_time', 'status', 'first_status'
+        )
+        for serial_no, subtask_id, update_time, status, first_status in rows.iterator(chunk_size=BATCH_SIZE):
+            if subtask_id not in subtask_ids:  # archived checks of deleted subtasks
+                continue
+            if first_status in RESULTS:
+                batch.append(StatusResult(serial_no=serial_no, subtask_id=subtask_id, status=first_status,
+                                          first=True, recorded_at=update_time))
+            if status in RESULTS and status != first_status:
+                batch.append(StatusResult(serial_no=serial_no, subtask_id=subtask_id, status=status,
+                                          recorded_at=update_time))
+            if len(batch) >= BATCH_SIZE:
+                StatusResult.objects.using(db).bulk_create(batch)
+                batch = []
+    StatusResult.objects.using(db).bulk_create(batch)
+
+    StatusRollup.objects.using(db).all().delete()
+    for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+        grouped = (
+            StatusResult.objects.using(db).annotate(bucket=trunc('recorded_at'))
+            .values('bucket', 'subtask_id')
+            .annotate(
+                ok_count=Count('id', filter=Q(status='OK')),
+                not_ok_count=Count('id', filter=Q(status='Not_OK')),
+                first_ok_count=Count('id', filter=Q(status='OK', first=True)),
+                first_not_ok_count=Count('id', filter=Q(status='Not_OK', first=True)),
+            )
+            .order_by()
+        )
+        StatusRollup.objects.using(db).bulk_create(
+            (StatusRollup(granularity=granularity, **row) for row in grouped), batch_size=BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_idempotencykey_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serial_no', models.CharField(db_index=True, max_length=50)),
+                ('status', models.CharField(max_length=10)),
+                ('first', models.BooleanField(default=False)),
+                ('recorded_at', models.DateTimeField(db_index=True)),
+                ('subtask', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.subtask')),
+            ],
+        ),
+        migrations.RunPython(backfill_results, migrations.RunPython.noop),
+    ]
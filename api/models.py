@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # ------------------------------
 # User
@@ -19,6 +20,7 @@ class User(models.Model):
 class ProductCategory(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    deleting = models.BooleanField(default=False)  # hidden while a DeletionJob removes it
 
     def __str__(self):
         return self.name
@@ -31,6 +33,12 @@ class Task(models.Model):
     category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, related_name='tasks')
     name = models.CharField(max_length=100)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_category_id = instance.__dict__.get('category_id')  # see signals.task_moved
+        return instance
+
     def __str__(self):
         return f"{self.name} ({self.category.name})"
 
@@ -49,6 +57,12 @@ class SubTask(models.Model):
     description = models.TextField(blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_task_id = instance.__dict__.get('task_id')  # see signals.subtask_moved
+        return instance
+
     def __str__(self):
         return f"{self.name} ({self.task.name})"
 
@@ -67,6 +81,19 @@ class ProductSerial(models.Model):
     product_name = models.CharField(max_length=100)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     subtask = models.ForeignKey(SubTask, on_delete=models.CASCADE, related_name='product_serials', null=True, blank=True)
+    # 👇 Station work-queue fields
+    priority = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    deleting = models.BooleanField(default=False)  # hidden while a DeletionJob removes it
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created_at']),
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['lease_expires']),
+        ]
 
     def __str__(self):
         return f"{self.serial_no} - {self.product.name} - {self.status}"
@@ -84,13 +111,176 @@ class SerialSubTaskStatus(models.Model):
 
     product_serial = models.ForeignKey(ProductSerial, on_delete=models.CASCADE, related_name='serial_subtasks')
     subtask = models.ForeignKey(SubTask, on_delete=models.CASCADE, related_name='serial_statuses')
+    # Copies of subtask.task / subtask.task.category so reports skip the joins; kept in sync by signals.py
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='+', null=True, db_index=False)
+    category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, related_name='+', null=True, db_index=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    first_status = models.CharField(max_length=10, choices=STATUS_CHOICES, null=True, blank=True)  # first OK / Not_OK result, for first-pass yield
   # 👇 New fields
     remark = models.TextField(null=True, blank=True)  # ✅ Added field for remarks
     updated_by = models.CharField(max_length=150, null=True, blank=True)
     update_time = models.DateTimeField(null=True, blank=True)
     class Meta:
         unique_together = ('product_serial', 'subtask')
+        indexes = [
+            models.Index(fields=['status', 'update_time']),
+            models.Index(fields=['update_time']),
+            models.Index(fields=['category', 'status', 'update_time']),
+            models.Index(fields=['task', 'status', 'update_time']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_subtask_id = instance.__dict__.get('subtask_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        moved = self.task_id is None or getattr(self, '_loaded_subtask_id', self.subtask_id) != self.subtask_id
+        if moved and self.subtask_id is not None:
+            self.task_id, self.category_id = SubTask.objects.filter(pk=self.subtask_id).values_list(
+                'task_id', 'task__category_id'
+            ).get()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'task', 'category'}
+        super().save(*args, **kwargs)
+        self._loaded_subtask_id = self.subtask_id
+
+    def __str__(self):
+        return f"{self.product_serial_id} - {self.subtask.name}: {self.status}"
+
+
+# ------------------------------
+# Idempotency Key (stored responses for retried POSTs)
+# ------------------------------
+class IdempotencyKey(models.Model):
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # Both empty while the first request with the key is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('endpoint', 'key')
+
+    def __str__(self):
+        return f"{self.endpoint} [{self.key}]"
+
+
+# ------------------------------
+# Archived Product Serial (cold storage for completed serials)
+# ------------------------------
+class ArchivedProductSerial(models.Model):
+    serial_no = models.CharField(max_length=50, primary_key=True)
+    product_id = models.BigIntegerField(db_index=True)
+    category_name = models.CharField(max_length=100)
+    product_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10)
+    subtask_id = models.BigIntegerField(null=True, blank=True)
+    archived_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.serial_no} - {self.category_name} - archived"
+
+
+# ------------------------------
+# Archived SerialSubTaskStatus (names are copied so lookups need no joins)
+# ------------------------------
+class ArchivedSerialSubTaskStatus(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    product_serial = models.ForeignKey(ArchivedProductSerial, on_delete=models.CASCADE, related_name='serial_subtasks')
+    subtask_id = models.BigIntegerField()
+    subtask_name = models.CharField(max_length=100)
+    task_id = models.BigIntegerField()
+    task_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10)
+    first_status = models.CharField(max_length=10, null=True, blank=True)
+    remark = models.TextField(null=True, blank=True)
+    updated_by = models.CharField(max_length=150, null=True, blank=True)
+    update_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.product_serial_id} - {self.subtask_name}: {self.status}"
+
+
+# ------------------------------
+# Status Rollup (hourly / daily OK and Not_OK counts per subtask)
+# ------------------------------
+class StatusRollup(models.Model):
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    subtask = models.ForeignKey(SubTask, on_delete=models.CASCADE, related_name='status_rollups')
+    ok_count = models.IntegerField(default=0)
+    not_ok_count = models.IntegerField(default=0)
+    first_ok_count = models.IntegerField(default=0)
+    first_not_ok_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('granularity', 'bucket', 'subtask')
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket:%Y-%m-%d %H:%M} - subtask {self.subtask_id}"
+
+
+# ------------------------------
+# Status Result (one row per OK / Not_OK result written; the rollups are sums of these)
+# ------------------------------
+class StatusResult(models.Model):
+    serial_no = models.CharField(max_length=50, db_index=True)  # no FK: results outlive archiving
+    subtask = models.ForeignKey(SubTask, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=10)
+    first = models.BooleanField(default=False)  # the check's first result, for first-pass yield
+    recorded_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.serial_no} - subtask {self.subtask_id}: {self.status} at {self.recorded_at:%Y-%m-%d %H:%M}"
+
+
+# ------------------------------
+# Catalogue Snapshot (flat categories / tasks / subtasks, one row per catalogue version)
+# ------------------------------
+class CatalogueSnapshot(models.Model):
+    version = models.BigAutoField(primary_key=True)
+    checksum = models.CharField(max_length=64)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Catalogue v{self.version}"
+
+
+# ------------------------------
+# Deletion Job (chunked background removal of a category or a batch of serials)
+# ------------------------------
+class DeletionJob(models.Model):
+    KIND_CHOICES = [
+        ('category', 'Category'),
+        ('serials', 'Product Serials'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    target = models.JSONField()  # category id, or list of serial numbers
+    database = models.CharField(max_length=50, default='default')  # plant database holding the serials
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    step = models.CharField(max_length=50, blank=True)
+    total_rows = models.IntegerField(null=True, blank=True)
+    deleted_rows = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"{self.product_serial.serial_no} - {self.subtask.name}: {self.status}"
+        return f"Delete {self.kind} {self.target} ({self.status})"
@@ -0,0 +1,193 @@
+"""
+Per-request profiling for production issues that don't reproduce locally.
+
+ProfilingMiddleware runs a request under cProfile (`cpu`) or tracemalloc
+(`mem`) when a staff user adds `?_profile=cpu|mem` or an `X-Profile` header,
+and for a random PROFILING['SAMPLE_RATE'] share of all requests (cpu). Every
+SQL statement is recorded through a connection execute_wrapper. The summary
+(top functions or allocation sites, and the SQL) is stored as
+<DIR>/<id>.json, with the raw cProfile stats as <id>.prof; only the newest
+KEEP profiles are kept. Staff responses carry the id and totals in
+X-Profile-* headers, and /api/profiles/ serves the stored files.
+
+tracemalloc traces the whole process, so allocations of requests running
+concurrently in other threads show up in `mem` profiles too. Overlapping
+`mem` profiles (gthread workers) share one tracing session, which stops when
+the last of them finishes.
+"""
+import cProfile
+import io
+import json
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+KINDS = ('cpu', 'mem')
+PROFILE_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+
+def config():
+    return {'SAMPLE_RATE': 0.0, 'DIR': settings.BASE_DIR / 'profiles', 'KEEP': 200, 'TOP': 25,
+            **getattr(settings, 'PROFILING', {})}
+
+
+def profile_dir():
+    return Path(config()['DIR'])
+
+
+def profile_path(profile_id, suffix):
+    """Path of a stored profile file, or None for anything that isn't a profile id"""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    return profile_dir() / f'{profile_id}{suffix}'
+
+
+class _SQLRecorder:
+    """execute_wrapper that notes every statement with its duration"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False  # tracemalloc was started here (not by PYTHONTRACEMALLOC or a debugger)
+
+
+@contextmanager
+def _tracing():
+    """Keep tracemalloc running while any `mem` profile is"""
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            _tracing_started = True
+        _tracing_users += 1
+    try:
+        yield
+    finally:
+        with _tracing_lock:
+            _tracing_users -= 1
+            if _tracing_users == 0 and _tracing_started:
+                tracemalloc.stop()
+                _tracing_started = False
+
+
+def _top_functions(profiler, top):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [
+        {
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+    ]
+
+
+def _allocation_sites(before, after, top):
+    return [
+        {
+            'location': str(stat.traceback),
+            'size_kb': round(stat.size_diff / 1024, 2),
+            'count': stat.count_diff,
+        }
+        for stat in after.compare_to(before, 'lineno')[:top]
+    ]
+
+
+def profile_request(request, get_response, kind):
+    """Run `get_response(request)` under the `kind` profiler; returns (response, summary, cProfile or None)"""
+    top = config()['TOP']
+    recorder = _SQLRecorder()
+    profiler = None
+    summary = {
+        'id': f"{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}",
+        'kind': kind,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'started_at': timezone.now().isoformat(),
+    }
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        if kind == 'cpu':
+            profiler = cProfile.Profile()
+        else:
+            stack.enter_context(_tracing())
+        before = tracemalloc.take_snapshot() if kind == 'mem' else None
+
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+            duration = time.perf_counter() - started
+
+        if kind == 'mem':
+            summary['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 2)
+            summary['allocations'] = _allocation_sites(before, tracemalloc.take_snapshot(), top)
+
+    summary.update({
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'query_count': len(recorder.queries),
+        'sql_ms': round(sum(q['ms'] for q in recorder.queries), 3),
+        'queries': recorder.queries,
+    })
+    if profiler:
+        summary['functions'] = _top_functions(profiler, top)
+    return response, summary, profiler
+
+
+def store(summary, profiler=None):
+    """Write the profile files and drop the oldest beyond KEEP"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_path(summary['id'], '.json').write_text(json.dumps(summary, default=str))
+    if profiler:
+        profiler.dump_stats(profile_path(summary['id'], '.prof'))
+
+    stored = sorted(directory.glob('*.json'))
+    for old in stored[:max(0, len(stored) - config()['KEEP'])]:
+        old.unlink(missing_ok=True)
+        old.with_suffix('.prof').unlink(missing_ok=True)
+
+
+def stored_profiles():
+    """Summaries (without the per-query / per-function lists) of the stored profiles, newest first"""
+    result = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):  # rotated away or half-written
+            continue
+        result.append({k: v for k, v in data.items() if k not in ('queries', 'functions', 'allocations')})
+    return result
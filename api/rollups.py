@@ -0,0 +1,121 @@
+"""
+Incremental maintenance of the StatusRollup table.
+
+Every OK / Not_OK result written to a SerialSubTaskStatus is logged as a
+StatusResult and counted in the hourly and daily bucket of the write that
+produced it; a check's first result also feeds the first-pass counts. A
+later result (a rework) is counted in its own bucket and never takes the
+earlier one back, so past defect rates don't change after the fact. Write
+paths take a `snapshot()` of each row before and after changing it and pass
+the pairs to `apply_changes()`. Deleting results (deletion.py) subtracts them
+again with `take_back()`. The `rebuild_rollups` command recomputes the same
+numbers from the StatusResult log.
+"""
+from collections import defaultdict
+
+from django.db import connections, router
+from django.utils import timezone
+
+from . import metrics
+from .models import StatusResult, StatusRollup
+
+GRANULARITIES = ('hour', 'day')
+
+STATUS_COUNTERS = {'OK': 'ok_count', 'Not_OK': 'not_ok_count'}
+FIRST_STATUS_COUNTERS = {'OK': 'first_ok_count', 'Not_OK': 'first_not_ok_count'}
+COUNTERS = ('ok_count', 'not_ok_count', 'first_ok_count', 'first_not_ok_count')
+
+
+def bucket_start(value, granularity):
+    """Start of the hour / day (in the project time zone) containing `value`"""
+    local = timezone.localtime(value)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def snapshot(record):
+    """The fields of a SerialSubTaskStatus that decide which results a write produced"""
+    return (record.product_serial_id, record.subtask_id, record.update_time, record.status, record.first_status)
+
+
+def results_written(before, after):
+    """StatusResult rows (unsaved) for the write that turned snapshot `before` into `after`"""
+    if after is None:
+        return []
+    serial_no, subtask_id, update_time, current, first = after
+    if update_time is None or (before is not None and before[2] == update_time):
+        return []
+    gave_first = first is not None and (before is None or before[4] is None)
+    results = []
+    if gave_first:
+        results.append(StatusResult(serial_no=serial_no, subtask_id=subtask_id, status=first, first=True,
+                                    recorded_at=update_time))
+    # Several writes merged into one (coalescer.py) can leave a current result after the first
+    if not gave_first or current != first:
+        results.append(StatusResult(serial_no=serial_no, subtask_id=subtask_id, status=current,
+                                    recorded_at=update_time))
+    return [r for r in results if r.status in STATUS_COUNTERS]
+
+
+def _add(deltas, result, sign):
+    for granularity in GRANULARITIES:
+        counts = deltas[(granularity, bucket_start(result.recorded_at, granularity), result.subtask_id)]
+        counts[STATUS_COUNTERS[result.status]] += sign
+        if result.first:
+            counts[FIRST_STATUS_COUNTERS[result.status]] += sign
+
+
+def _upsert(connection, deltas):
+    rows = [
+        (granularity, connection.ops.adapt_datetimefield_value(bucket), subtask_id,
+         *(counts[c] for c in COUNTERS))
+        for (granularity, bucket, subtask_id), counts in deltas.items()
+        if any(counts.values())
+    ]
+    if not rows:
+        return
+
+    table = StatusRollup._meta.db_table
+    # One upsert statement for every touched bucket; the ORM can only overwrite on conflict, not add
+    sql = (
+        f'INSERT INTO "{table}" (granularity, bucket, subtask_id, {", ".join(COUNTERS)}) '
+        f'VALUES (%s, %s, %s, %s, %s, %s, %s) '
+        f'ON CONFLICT (granularity, bucket, subtask_id) DO UPDATE SET '
+        + ', '.join(f'{c} = "{table}".{c} + excluded.{c}' for c in COUNTERS)
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def apply_changes(changes):
+    """
+    Log and count the results produced by `(before, after)` snapshot pairs.
+    `before` is None for new rows. Must run in the same transaction (and database) as the status writes.
+    """
+    connection = connections[router.db_for_write(StatusRollup)]
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    updates = defaultdict(int)
+    results = []
+    for before, after in changes:
+        if before == after:
+            continue
+        if before is not None and after is not None:
+            updates[after[3]] += 1
+        for result in results_written(before, after):
+            results.append(result)
+            _add(deltas, result, 1)
+    if updates:
+        metrics.record_status_updates(updates, using=connection.alias)
+    if results:
+        StatusResult.objects.using(connection.alias).bulk_create(results)
+    _upsert(connection, deltas)
+
+
+def take_back(results):
+    """Subtract the StatusResult rows of queryset `results` (about to be deleted) from the rollups"""
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for result in results.only('subtask_id', 'status', 'first', 'recorded_at'):
+        if result.status in STATUS_COUNTERS:
+            _add(deltas, result, -1)
+    _upsert(connections[results.db], deltas)
@@ -0,0 +1,75 @@
+"""
+Per-plant partitioning of the shop-floor tables.
+
+Each plant listed in settings.PLANT_DATABASES gets its own SQLite file (and so
+its own writer lock) for product serials, subtask statuses and the tables
+written alongside them. PlantMiddleware picks the database for a request from
+the `X-Plant` header or `?plant=`; requests without a plant use 'default'.
+
+The catalogue (categories, tasks, subtasks), users, snapshots and deletion
+jobs stay in 'default'. Every plant database has the full schema and keeps a
+read-only copy of the catalogue tables (see catalogue.sync_replicas()), so
+foreign keys and joins from serials / statuses to the catalogue keep working.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PARTITIONED_MODELS = {
+    'productserial',
+    'serialsubtaskstatus',
+    'statusrollup',
+    'statusresult',
+    'idempotencykey',
+    'archivedproductserial',
+    'archivedserialsubtaskstatus',
+}
+
+_current_database = ContextVar('plant_database', default=DEFAULT_DB_ALIAS)
+
+
+def plant_databases():
+    """{plant: database alias} for every configured plant"""
+    return getattr(settings, 'PLANT_DATABASES', {})
+
+
+def partition_databases():
+    """Every database holding partitioned rows, 'default' first"""
+    return [DEFAULT_DB_ALIAS, *plant_databases().values()]
+
+
+def is_partitioned(model):
+    return model._meta.app_label == 'api' and model._meta.model_name in PARTITIONED_MODELS
+
+
+def current_database():
+    """Database the partitioned models of the current request / thread live in"""
+    return _current_database.get()
+
+
+@contextmanager
+def use_database(alias):
+    token = _current_database.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_database.reset(token)
+
+
+class PlantRouter:
+
+    def db_for_read(self, model, **hints):
+        if is_partitioned(model):
+            return current_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_partitioned(model):
+            return current_database()
+        # Catalogue writes always go to 'default'; plant copies are refreshed from there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
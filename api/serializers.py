@@ -6,7 +6,9 @@ from .models import (
     Task,
     SubTask,
     ProductSerial,
-    SerialSubTaskStatus
+    SerialSubTaskStatus,
+    ArchivedSerialSubTaskStatus,
+    DeletionJob
 )
 
 # ------------------------------
@@ -53,7 +55,8 @@ class ProductSerialSerializer(serializers.ModelSerializer):
             'product_name',
             'status',
             'subtask',
-            'subtask_name'
+            'subtask_name',
+            'priority'
         ]
         read_only_fields = ['product_name', 'subtask_name']
 
@@ -109,9 +112,18 @@ class ProductCategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'tasks']
 
 
+def resolve_updated_by(request, updated_by=None):
+    """Use the Flutter value if provided, else request.user, else "Unknown"."""
+    if updated_by:
+        return updated_by
+    if request and hasattr(request, 'user') and request.user.is_authenticated:
+        return getattr(request.user, 'name', None) or getattr(request.user, 'username', 'Unknown')
+    return "Unknown"
+
+
 class SerialSubTaskStatusSerializer(serializers.ModelSerializer):
     subtask_name = serializers.CharField(source='subtask.name', read_only=True)
-    task_id = serializers.IntegerField(source='subtask.task.id', read_only=True)
+    task_id = serializers.IntegerField(read_only=True)
     task_name = serializers.CharField(source='subtask.task.name', read_only=True)
     serial_no = serializers.CharField(source='product_serial.serial_no', read_only=True)
     product_name = serializers.CharField(source='product_serial.product.name', read_only=True)
@@ -155,17 +167,59 @@ class SerialSubTaskStatusSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         instance.status = validated_data.get('status', instance.status)
+        if instance.first_status is None and instance.status != 'pending':
+            instance.first_status = instance.status
         instance.remark = validated_data.get('remark', instance.remark)
 
-        # ✅ Use Flutter value if provided, else request.user, else "Unknown"
-        request = self.context.get('request')
-        if 'updated_by' in validated_data and validated_data['updated_by']:
-            instance.updated_by = validated_data['updated_by']
-        elif request and hasattr(request, 'user') and request.user.is_authenticated:
-            instance.updated_by = getattr(request.user, 'name', None) or getattr(request.user, 'username', 'Unknown')
-        else:
-            instance.updated_by = "Unknown"
+        instance.updated_by = resolve_updated_by(self.context.get('request'), validated_data.get('updated_by'))
 
         instance.update_time = timezone.now()
         instance.save()
         return instance
+
+
+# ------------------------------
+# ✅ Archived SerialSubTaskStatus Serializer (same shape as SerialSubTaskStatusSerializer)
+# ------------------------------
+class ArchivedSerialSubTaskStatusSerializer(serializers.ModelSerializer):
+    serial_no = serializers.CharField(source='product_serial_id', read_only=True)
+    product_name = serializers.CharField(source='product_serial.category_name', read_only=True)
+    subtask = serializers.IntegerField(source='subtask_id', read_only=True)
+
+    class Meta:
+        model = ArchivedSerialSubTaskStatus
+        fields = [
+            'id',
+            'serial_no',
+            'product_name',
+            'task_id',
+            'task_name',
+            'subtask',
+            'subtask_name',
+            'status',
+            'updated_by',
+            'remark',
+            'update_time'
+        ]
+        read_only_fields = fields
+
+
+# ------------------------------
+# ✅ Deletion Job Serializer
+# ------------------------------
+class DeletionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeletionJob
+        fields = [
+            'id',
+            'kind',
+            'target',
+            'status',
+            'step',
+            'total_rows',
+            'deleted_rows',
+            'error',
+            'created_at',
+            'finished_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,60 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import metrics
+from .catalogue import SNAPSHOT_FIELDS, schedule_refresh
+from .models import ProductCategory, Task, SubTask, SerialSubTaskStatus
+from .routers import partition_databases
+
+
+# ------------------------------
+# Rebuild the catalogue snapshot after any category / task / subtask change
+# ------------------------------
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=SubTask)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=SubTask)
+def catalogue_changed(sender, using, update_fields=None, **kwargs):
+    # Changes to the plant databases' copies come from the refresh itself
+    if using != DEFAULT_DB_ALIAS:
+        return
+    # Saves of fields outside the snapshot (e.g. SubTask.status) leave it as it is
+    if update_fields is not None and not {sender._meta.get_field(f).name for f in update_fields} & SNAPSHOT_FIELDS[sender]:
+        return
+    schedule_refresh()
+
+
+# ------------------------------
+# Keep SerialSubTaskStatus.task / .category in step when a subtask or task moves
+# ------------------------------
+@receiver(post_save, sender=SubTask)
+def subtask_moved(sender, instance, created, **kwargs):
+    if created or getattr(instance, '_loaded_task_id', None) == instance.task_id:
+        return
+    category_id = Task.objects.filter(pk=instance.task_id).values_list('category_id', flat=True).first()
+    for alias in partition_databases():
+        SerialSubTaskStatus.objects.using(alias).filter(subtask=instance).update(
+            task_id=instance.task_id, category_id=category_id
+        )
+    instance._loaded_task_id = instance.task_id
+
+
+@receiver(post_save, sender=Task)
+def task_moved(sender, instance, created, **kwargs):
+    if created or getattr(instance, '_loaded_category_id', None) == instance.category_id:
+        return
+    for alias in partition_databases():
+        SerialSubTaskStatus.objects.using(alias).filter(task=instance).update(category_id=instance.category_id)
+    instance._loaded_category_id = instance.category_id
+
+
+# ------------------------------
+# Query metrics on every new database connection
+# ------------------------------
+@receiver(connection_created)
+def track_queries(sender, connection, **kwargs):
+    metrics.track_connection(connection)
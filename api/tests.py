@@ -1,3 +1,1314 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import importlib
+import json
+import sqlite3
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import F, QuerySet
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.renderers import JSONRenderer
+
+from . import catalogue, coalescer, deletion, fast_reads, metrics, profiling, warmup
+from .backup import prune, quick_check, sha256_file, snapshot
+from .catalogue import cached_diff, refresh_snapshot
+from .routers import plant_databases
+from .models import (
+    User,
+    ProductCategory,
+    Task,
+    SubTask,
+    ProductSerial,
+    SerialSubTaskStatus,
+    StatusResult,
+    StatusRollup,
+    DeletionJob,
+    IdempotencyKey,
+    ArchivedProductSerial,
+    ArchivedSerialSubTaskStatus,
+)
+from .serializers import (
+    ProductSerialSerializer,
+    SubTaskSerializer,
+    SerialSubTaskStatusSerializer
+)
+
+PLANTS = plant_databases()
+# Catalogue changes are copied into every plant database (when PQC_PLANTS is set)
+DATABASES = {'default', *PLANTS.values()}
+
+
+def seed(categories, tasks, subtasks, serials):
+    """
+    Build a catalogue of `categories` x `tasks` x `subtasks` with `serials`
+    product serials per category, every status row materialized and a mix
+    of pending / OK / Not_OK results.
+    """
+    User.objects.bulk_create([
+        User(name=f"User {i}", designation="Operator", email=f"user{i}@example.com", password="secret")
+        for i in range(categories)
+    ])
+    now = timezone.now()
+    for c in range(categories):
+        category = ProductCategory.objects.create(name=f"Category {c}")
+        task_objs = Task.objects.bulk_create([
+            Task(category=category, name=f"Task {c}.{t}") for t in range(tasks)
+        ])
+        subtask_objs = SubTask.objects.bulk_create([
+            SubTask(task=task, name=f"Check {task.name}.{s}", description="Look at it")
+            for task in task_objs for s in range(subtasks)
+        ])
+        serial_objs = ProductSerial.objects.bulk_create([
+            ProductSerial(
+                serial_no=f"SN-{c}-{n:04d}",
+                product=category,
+                product_name=f"Product {c}",
+                subtask=subtask_objs[n % len(subtask_objs)],
+                priority=n % 3,
+            )
+            for n in range(serials)
+        ])
+        statuses = SerialSubTaskStatus.objects.bulk_create([
+            SerialSubTaskStatus(
+                product_serial=serial,
+                subtask=subtask,
+                task_id=subtask.task_id,
+                category=category,
+                status=status,
+                first_status=None if status == 'pending' else status,
+                updated_by=None if status == 'pending' else "Operator",
+                update_time=None if status == 'pending' else now - timedelta(hours=i % 48),
+            )
+            for i, (serial, subtask) in enumerate(
+                (serial, subtask) for serial in serial_objs for subtask in subtask_objs
+            )
+            for status in [('pending', 'OK', 'OK', 'Not_OK')[i % 4]]
+        ])
+        StatusResult.objects.bulk_create([
+            StatusResult(serial_no=st.product_serial_id, subtask_id=st.subtask_id, status=st.status, first=True,
+                         recorded_at=st.update_time)
+            for st in statuses if st.update_time
+        ])
+    call_command('rebuild_rollups', stdout=StringIO())
+    refresh_snapshot()
+
+
+def rollup_rows():
+    # Buckets emptied by incremental updates stay behind as all-zero rows; rebuild drops them
+    return sorted(StatusRollup.objects.exclude(
+        ok_count=0, not_ok_count=0, first_ok_count=0, first_not_ok_count=0
+    ).values_list(
+        'granularity', 'bucket', 'subtask_id', 'ok_count', 'not_ok_count', 'first_ok_count', 'first_not_ok_count'
+    ))
+
+
+class RouteQueryCounts:
+    """
+    Exact query counts for every route in api/urls.py. The same expectations
+    run against a small and a large dataset, so any query that scales with
+    the number of rows fails one of the two test cases.
+    """
+    databases = DATABASES
+    SIZE = None
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(**cls.SIZE)
+        cls.category = ProductCategory.objects.order_by('id').first()
+        cls.task = cls.category.tasks.order_by('id').first()
+        cls.subtask = cls.task.subtasks.order_by('id').first()
+        cls.serial = cls.category.product_serials.order_by('serial_no').first()
+        cls.user = User.objects.order_by('id').first()
+
+    def assertQueries(self, expected, method, url, data=None, **headers):
+        with self.assertNumQueries(expected):
+            response = getattr(self.client, method)(url, data, content_type='application/json', headers=headers)
+        self.assertLess(response.status_code, 400, response.content[:500])
+        return response
+
+    def status_updates(self, count=3):
+        ids = SerialSubTaskStatus.objects.filter(product_serial=self.serial).order_by('id').values_list('id', flat=True)
+        return {
+            "serial_no": self.serial.serial_no,
+            "updates": [{"id": i, "status": "OK", "updated_by": "QA"} for i in ids[:count]],
+        }
+
+    # ------------------------------
+    # Router: list / retrieve
+    # ------------------------------
+    def test_users(self):
+        self.assertQueries(1, 'get', '/api/users/')
+        self.assertQueries(1, 'get', f'/api/users/{self.user.id}/')
+
+    def test_categories(self):
+        self.assertQueries(4, 'get', '/api/categories/')
+        self.assertQueries(4, 'get', f'/api/categories/{self.category.id}/')
+
+    def test_category_clone(self):
+        # category insert + tasks read + tasks bulk insert + subtasks read + subtasks bulk insert, in a savepoint
+        self.assertQueries(8, 'post', f'/api/categories/{self.category.id}/clone/', {"name": "Variant B"})
+
+    def test_tasks(self):
+        self.assertQueries(3, 'get', '/api/tasks/')
+        self.assertQueries(3, 'get', f'/api/tasks/{self.task.id}/')
+
+    def test_subtasks(self):
+        self.assertQueries(2, 'get', '/api/subtasks/')
+        self.assertQueries(2, 'get', f'/api/subtasks/{self.subtask.id}/')
+
+    def test_product_serials(self):
+        self.assertQueries(1, 'get', '/api/product-serials/')
+        self.assertQueries(1, 'get', f'/api/product-serials/{self.serial.serial_no}/')
+
+    def test_serial_statuses(self):
+        self.assertQueries(2, 'get', f'/api/serial-statuses/?status=Not_OK&task={self.task.id}')
+        status_id = SerialSubTaskStatus.objects.filter(product_serial=self.serial).values_list('id', flat=True)[0]
+        self.assertQueries(1, 'get', f'/api/serial-statuses/{status_id}/')
+
+    # ------------------------------
+    # Router: custom actions
+    # ------------------------------
+    def test_subtasks_by_task(self):
+        self.assertQueries(3, 'get', f'/api/subtasks/by-task/?task_id={self.task.id}')
+
+    def drop_queued_refresh(self):
+        # setUpTestData's saves queued a catalogue refresh that a TestCase never runs; schedule_refresh() would
+        # see it and not queue the one under test
+        connection.run_on_commit.clear()
+
+    def test_subtask_update_status(self):
+        # Counted with the on_commit callbacks: the status isn't in the catalogue snapshot, so nothing is refreshed
+        self.drop_queued_refresh()
+        with self.assertNumQueries(3), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/subtasks/{self.subtask.id}/update-status/', {"status": "OK"},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_subtask_rename_refreshes_the_catalogue(self):
+        version = refresh_snapshot().version
+        self.drop_queued_refresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/subtasks/{self.subtask.id}/', {"name": "Renamed"},
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(catalogue.latest_snapshot().version, version + 1)
+
+    def test_product_serials_by_product(self):
+        self.assertQueries(1, 'get', f'/api/product-serials/by-product/?product_id={self.category.id}')
+
+    def test_analytics(self):
+        self.assertQueries(1, 'get', '/api/analytics/defect-rates/?group_by=category&granularity=hour')
+        self.assertQueries(1, 'get', '/api/analytics/first-pass-yield/')
+
+    def test_station_queue(self):
+        claim = self.assertQueries(2, 'post', '/api/station-queue/claim/', {"station": "S1"})
+        serial_no = claim.json()["serial"]["serial_no"]
+        self.assertQueries(1, 'post', '/api/station-queue/release/', {"serial_no": serial_no, "station": "S1"})
+        self.assertQueries(1, 'post', '/api/station-queue/release-expired/')
+
+    def test_deletion_jobs(self):
+        DeletionJob.objects.bulk_create([
+            DeletionJob(kind='serials', target=[f"SN-{i}"], status='done') for i in range(self.SIZE['serials'])
+        ])
+        job = DeletionJob.objects.order_by('id').first()
+        self.assertQueries(1, 'get', '/api/deletion-jobs/')
+        self.assertQueries(1, 'get', f'/api/deletion-jobs/{job.id}/')
+
+    # ------------------------------
+    # Plain API views
+    # ------------------------------
+    def test_login(self):
+        self.assertQueries(1, 'post', '/api/login/', {"email": self.user.email, "password": "secret"})
+
+    def test_catalogue(self):
+        response = self.assertQueries(1, 'get', '/api/catalogue/')
+        version = response.json()["version"]
+        self.assertQueries(1, 'get', f'/api/catalogue/?since={version}')
+
+    @override_settings(BATCH_READ_WORKERS=1)
+    def test_batch(self):
+        # The sub-requests' own queries, nothing per item on top
+        self.assertQueries(3, 'post', '/api/batch/', {"requests": [
+            {"method": "GET", "path": "/api/product-serials/"},
+            {"method": "GET", "path": f"/api/subtasks/{self.subtask.id}/"},
+        ]})
+
+    def test_subtasks_by_serial_get(self):
+        self.assertQueries(3, 'get', f'/api/subtasks-by-serial/?serial_number={self.serial.serial_no}')
+
+    def test_subtasks_by_serial_post(self):
+        subtask_ids = self.task.subtasks.order_by('id').values_list('id', flat=True)[:3]
+        self.assertQueries(9, 'post', '/api/subtasks-by-serial/', {
+            "serial_no": self.serial.serial_no,
+            "updates": [{"subtask_id": s, "value": "OK"} for s in subtask_ids],
+        })
+
+    def test_subtask_status_update(self):
+        # 2 reads, savepoint, one UPDATE per item, one result insert, one rollup upsert, release
+        self.assertQueries(9, 'post', '/api/subtask-status-update/', self.status_updates(3))
+
+    def test_subtask_status_update_replay(self):
+        body = self.status_updates(3)
+        self.assertQueries(17, 'post', '/api/subtask-status-update/', body, **{"Idempotency-Key": "k-1"})
+        response = self.assertQueries(1, 'post', '/api/subtask-status-update/', body, **{"Idempotency-Key": "k-1"})
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+
+    def test_serial_task_status(self):
+        self.assertQueries(9, 'post', '/api/serial-task-status/', {
+            "serial_no": self.serial.serial_no, "task_id": self.task.id, "status": "OK",
+        })
+
+
+class SmallDatasetQueryCountTests(RouteQueryCounts, TestCase):
+    SIZE = dict(categories=2, tasks=2, subtasks=3, serials=3)
+
+
+class LargeDatasetQueryCountTests(RouteQueryCounts, TestCase):
+    SIZE = dict(categories=4, tasks=5, subtasks=6, serials=25)
+
+
+class FastReadEquivalenceTests(TestCase):
+    """The values()-based read paths must render byte-for-byte like the serializers they replace"""
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=2, tasks=2, subtasks=3, serials=4)
+        cls.category = ProductCategory.objects.order_by('id').first()
+        cls.task = cls.category.tasks.order_by('id').first()
+        cls.serial = cls.category.product_serials.order_by('serial_no').first()
+        # Cover empty / null columns as well
+        ProductSerial.objects.create(serial_no="SN-NO-SUBTASK", product=cls.category, product_name="Bare")
+        SerialSubTaskStatus.objects.filter(product_serial=cls.serial).exclude(update_time=None).update(remark="Scratch")
+
+    def assertSameJSON(self, fast, slow):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast), renderer.render(slow))
+
+    def test_serial_statuses(self):
+        statuses = SerialSubTaskStatus.objects.filter(product_serial=self.serial).order_by('id')
+        self.assertSameJSON(
+            fast_reads.serial_statuses(statuses),
+            SerialSubTaskStatusSerializer(statuses, many=True).data,
+        )
+
+    def test_product_serials(self):
+        serials = ProductSerial.objects.filter(product=self.category)
+        self.assertSameJSON(
+            fast_reads.product_serials(serials),
+            ProductSerialSerializer(serials, many=True).data,
+        )
+
+    def test_subtasks(self):
+        subtasks = self.task.subtasks.all()
+        self.assertSameJSON(
+            fast_reads.subtasks(subtasks),
+            SubTaskSerializer(subtasks, many=True).data,
+        )
+
+    def test_endpoints(self):
+        response = self.client.get(f'/api/subtasks-by-serial/?serial_number={self.serial.serial_no}')
+        statuses = SerialSubTaskStatus.objects.filter(product_serial=self.serial).order_by('id')
+        self.assertSameJSON(response.json()["subtask_statuses"], SerialSubTaskStatusSerializer(statuses, many=True).data)
+
+        response = self.client.get(f'/api/product-serials/by-product/?product_id={self.category.id}')
+        serials = ProductSerial.objects.filter(product=self.category)
+        self.assertSameJSON(response.json(), ProductSerialSerializer(serials, many=True).data)
+
+        response = self.client.get(f'/api/subtasks/by-task/?task_id={self.task.id}')
+        self.assertSameJSON(response.json()["subtasks"], SubTaskSerializer(self.task.subtasks.all(), many=True).data)
+
+
+class AdminChangelistTests(TestCase):
+    """Changelists must not issue a query per row (no FK walks in __str__, no full counts)"""
+    databases = DATABASES
+
+    def setUp(self):
+        from django.contrib.auth.models import User as StaffUser
+        staff = StaffUser.objects.create_superuser("admin", "admin@example.com", "secret")
+        self.client.force_login(staff)
+
+    def changelist_queries(self):
+        counts = {}
+        for model in ('user', 'productcategory', 'task', 'subtask', 'productserial', 'serialsubtaskstatus'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/admin/api/{model}/')
+            self.assertEqual(response.status_code, 200)
+            counts[model] = len(queries)
+        return counts
+
+    def test_changelists_do_not_scale_with_rows(self):
+        seed(categories=1, tasks=2, subtasks=2, serials=2)
+        small = self.changelist_queries()
+        ProductCategory.objects.all().delete()
+        User.objects.all().delete()
+        seed(categories=3, tasks=4, subtasks=5, serials=10)
+        self.assertEqual(small, self.changelist_queries())
+
+    def test_status_edit_is_logged_and_counted(self):
+        seed(categories=1, tasks=1, subtasks=1, serials=1)
+        record = SerialSubTaskStatus.objects.get()
+        SerialSubTaskStatus.objects.filter(pk=record.pk).update(status='pending', first_status=None, update_time=None)
+        StatusResult.objects.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+
+        response = self.client.post(f'/admin/api/serialsubtaskstatus/{record.pk}/change/', {
+            "product_serial": record.product_serial_id, "subtask": record.subtask_id, "status": "Not_OK",
+            "remark": "", "updated_by": "QA", "update_time_0": "", "update_time_1": "",
+        })
+        self.assertEqual(response.status_code, 302)
+
+        record.refresh_from_db()
+        self.assertEqual((record.status, record.first_status), ("Not_OK", "Not_OK"))
+        self.assertIsNotNone(record.update_time)
+        self.assertEqual(list(StatusResult.objects.values_list('status', 'first')), [("Not_OK", True)])
+        incremental = rollup_rows()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(incremental, rollup_rows())
+        self.assertTrue(incremental)
+
+
+@override_settings(DELETION_IN_BACKGROUND=False, DELETION_CHUNK_SIZE=7, DELETION_CHUNK_PAUSE=0)
+class ChunkedDeletionTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=2, tasks=2, subtasks=3, serials=5)
+        cls.category, cls.other = ProductCategory.objects.order_by('id')
+
+    def test_category(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/categories/{self.category.id}/?mode=chunked')
+        self.assertEqual(response.status_code, 202)
+
+        job = DeletionJob.objects.get(pk=response.json()["id"])
+        self.assertEqual((job.status, job.deleted_rows), ('done', job.total_rows))
+        self.assertFalse(ProductCategory.objects.filter(pk=self.category.pk).exists())
+        self.assertFalse(Task.objects.filter(category=self.category).exists())
+        self.assertFalse(ProductSerial.objects.filter(product=self.category).exists())
+        self.assertEqual(
+            SerialSubTaskStatus.objects.count(),
+            SerialSubTaskStatus.objects.filter(product_serial__product=self.other).count(),
+        )
+        self.assertEqual(self.client.get(f'/api/deletion-jobs/{job.id}/').json()["status"], 'done')
+
+    def test_category_hidden_while_deleting(self):
+        ProductCategory.objects.filter(pk=self.category.pk).update(deleting=True)
+        ids = [c["id"] for c in self.client.get('/api/categories/').json()]
+        self.assertEqual(ids, [self.other.id])
+        self.assertEqual(self.client.get(f'/api/tasks/?category={self.category.id}').status_code, 200)
+        self.assertFalse(any(t["category"] == self.category.id for t in self.client.get('/api/tasks/').json()))
+
+    def test_reads_between_steps(self):
+        serial_no = self.category.product_serials.values_list('serial_no', flat=True).first()
+        delete_chunks = deletion._delete_chunks
+        reads = []
+
+        def delete_then_read(job, queryset):
+            delete_chunks(job, queryset)
+            if queryset.model is SerialSubTaskStatus:
+                # Must not recreate the checklist the job just removed
+                reads.append(self.client.get('/api/subtasks-by-serial/', {"serial_number": serial_no}).status_code)
+
+        with mock.patch.object(deletion, '_delete_chunks', delete_then_read):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(f'/api/categories/{self.category.id}/?mode=chunked')
+
+        self.assertEqual(DeletionJob.objects.get(pk=response.json()["id"]).status, 'done')
+        self.assertTrue(reads)
+        self.assertEqual(set(reads), {404})
+        self.assertFalse(ProductSerial.objects.filter(serial_no=serial_no).exists())
+
+    def test_serials_hidden_while_deleting(self):
+        serial = self.category.product_serials.order_by('serial_no').first()
+        ProductSerial.objects.filter(pk=serial.pk).update(deleting=True)
+        task = serial.subtask.task
+
+        nested = [
+            self.client.get(f'/api/categories/{self.category.id}/').json()["tasks"],
+            [self.client.get(f'/api/tasks/{task.id}/').json()],
+            [{"subtasks": [self.client.get(f'/api/subtasks/{serial.subtask_id}/').json()]}],
+            [{"subtasks": self.client.get(f'/api/subtasks/by-task/?task_id={task.id}').json()["subtasks"]}],
+        ]
+        for tasks in nested:
+            serial_nos = [p["serial_no"] for t in tasks for s in t["subtasks"] for p in s["product_serials"]]
+            self.assertNotIn(serial.serial_no, serial_nos)
+
+    def test_serial_batch(self):
+        serial_nos = list(self.category.product_serials.values_list('serial_no', flat=True)[:3])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/product-serials/bulk-delete/', {"serial_nos": serial_nos},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(ProductSerial.objects.filter(serial_no__in=serial_nos).exists())
+        self.assertFalse(SerialSubTaskStatus.objects.filter(product_serial_id__in=serial_nos).exists())
+
+        # Rollups were adjusted chunk by chunk; a full rebuild must agree
+        incremental = rollup_rows()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(incremental, rollup_rows())
+
+
+class ArchiveSerialsTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=2, serials=2)
+        cls.old, cls.recent = ProductSerial.objects.order_by('serial_no')
+        ProductSerial.objects.update(status='completed')
+        SerialSubTaskStatus.objects.filter(product_serial=cls.old).update(
+            update_time=timezone.now() - timedelta(days=400)
+        )
+
+    def test_archive_and_read_back(self):
+        url = f'/api/subtasks-by-serial/?serial_number={self.old.serial_no}'
+        live = self.client.get(url).json()
+        call_command('archive_serials', '--days', '365', '--skip-vacuum', stdout=StringIO())
+
+        self.assertFalse(ProductSerial.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(SerialSubTaskStatus.objects.filter(product_serial_id=self.old.pk).exists())
+        self.assertTrue(ProductSerial.objects.filter(pk=self.recent.pk).exists())
+        self.assertEqual(ArchivedProductSerial.objects.get().serial_no, self.old.serial_no)
+        self.assertEqual(ArchivedSerialSubTaskStatus.objects.count(), 2)
+
+        archived = self.client.get(url).json()
+        self.assertTrue(archived["archived"])
+        self.assertEqual(archived["product_serial"], live["product_serial"])
+        self.assertEqual(archived["subtask_statuses"], live["subtask_statuses"])
+
+        response = self.client.post('/api/product-serials/', {
+            "serial_no": self.old.serial_no, "product": self.old.product_id, "product_name": "Reused",
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_rerun_counts_only_new_rows(self):
+        # A run interrupted after copying the serial and one status, before removing them
+        ArchivedProductSerial.objects.create(
+            serial_no=self.old.serial_no, product_id=self.old.product_id, category_name="Category 0",
+            product_name=self.old.product_name, status='completed', archived_at=timezone.now(),
+        )
+        status = self.old.serial_subtasks.order_by('id').select_related('subtask__task').first()
+        ArchivedSerialSubTaskStatus.objects.create(
+            id=status.id, product_serial_id=self.old.serial_no, subtask_id=status.subtask_id,
+            subtask_name=status.subtask.name, task_id=status.subtask.task_id, task_name=status.subtask.task.name,
+            status=status.status,
+        )
+
+        out = StringIO()
+        call_command('archive_serials', '--days', '365', '--skip-vacuum', stdout=out)
+        self.assertIn("Archived 0 serials and 1 subtask statuses", out.getvalue())
+        self.assertFalse(ProductSerial.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(ArchivedSerialSubTaskStatus.objects.count(), 2)
+
+
+class ArchiveVacuumTests(TransactionTestCase):
+    """VACUUM can't run inside the transaction a TestCase wraps around each test"""
+    databases = DATABASES
+
+    def test_enable_incremental(self):
+        out = StringIO()
+        call_command('archive_serials', '--enable-incremental', stdout=out)
+        for database in PLANTS.values() or ['default']:
+            with connections[database].cursor() as cursor:
+                cursor.execute("PRAGMA auto_vacuum")
+                self.assertEqual(cursor.fetchone()[0], 2)
+        self.assertIn("incremental vacuum done", out.getvalue())
+
+
+class RollupTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=1, serials=1)
+        cls.record = SerialSubTaskStatus.objects.get()
+        SerialSubTaskStatus.objects.filter(pk=cls.record.pk).update(status='pending', first_status=None, update_time=None)
+        StatusResult.objects.all().delete()
+        StatusRollup.objects.all().delete()
+
+    def post_at(self, when, value):
+        with mock.patch('django.utils.timezone.now', return_value=when):
+            response = self.client.post('/api/subtask-status-update/', {
+                "serial_no": self.record.product_serial_id,
+                "updates": [{"id": self.record.pk, "status": value, "updated_by": "QA"}],
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def day(self, when):
+        return StatusRollup.objects.filter(granularity='day', bucket__lte=when).order_by('-bucket').values_list(
+            'ok_count', 'not_ok_count', 'first_ok_count', 'first_not_ok_count'
+        ).first()
+
+    def test_rework_keeps_earlier_results(self):
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        self.post_at(yesterday, "Not_OK")
+        self.post_at(today, "OK")
+
+        # Yesterday's failure stays counted yesterday, as the first result; the rework counts today
+        self.assertEqual(self.day(yesterday), (0, 1, 0, 1))
+        self.assertEqual(self.day(today), (1, 0, 0, 0))
+
+        incremental = rollup_rows()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(incremental, rollup_rows())
+
+
+    def test_analytics_filters_must_be_ids(self):
+        for param in ('subtask', 'task', 'category'):
+            for url in ('/api/analytics/defect-rates/', '/api/analytics/first-pass-yield/'):
+                self.assertEqual(self.client.get(url, {param: "abc"}).status_code, 400)
+        response = self.client.get('/api/analytics/defect-rates/', {"subtask": self.record.subtask_id})
+        self.assertEqual(response.status_code, 200)
+
+
+class SerialTaskStatusTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=2, serials=1)
+        cls.serial = ProductSerial.objects.get()
+        cls.task = Task.objects.get()
+        first, second = cls.serial.serial_subtasks.order_by('id')
+        SerialSubTaskStatus.objects.filter(pk=first.pk).update(status='pending')
+        SerialSubTaskStatus.objects.filter(pk=second.pk).update(status='Not_OK')
+
+    def post(self, **body):
+        return self.client.post('/api/serial-task-status/', {
+            "serial_no": self.serial.serial_no, "task_id": self.task.id, "status": "OK", **body,
+        }, content_type='application/json')
+
+    def test_only_pending_false_updates_every_status(self):
+        self.assertEqual(self.post(only_pending="false").json()["updated_count"], 2)
+
+    def test_only_pending(self):
+        self.assertEqual(self.post(only_pending="true").json()["updated_count"], 1)
+
+    def test_rejects_malformed_fields(self):
+        self.assertEqual(self.post(task_id="abc").status_code, 400)
+        self.assertEqual(self.post(only_pending="sometimes").status_code, 400)
+        self.assertFalse(SerialSubTaskStatus.objects.filter(status='OK').exists())
+
+
+class StationQueueTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=1, serials=0)
+        cls.category = ProductCategory.objects.get()
+        now = timezone.now()
+        # (serial_no, priority, age in minutes)
+        ProductSerial.objects.bulk_create([
+            ProductSerial(serial_no=serial_no, product=cls.category, product_name="Product", priority=priority,
+                          created_at=now - timedelta(minutes=age))
+            for serial_no, priority, age in [("SN-A", 0, 30), ("SN-B", 2, 10), ("SN-C", 2, 20), ("SN-D", 1, 40)]
+        ])
+
+    def claim(self, station="S1", **body):
+        return self.client.post('/api/station-queue/claim/', {"station": station, **body},
+                                content_type='application/json')
+
+    def claimed(self, station="S1", **body):
+        response = self.claim(station, **body)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["serial"]["serial_no"]
+
+    def test_claims_never_share_a_serial(self):
+        claimed = [self.claimed(station=f"S{i % 2}") for i in range(4)]
+        self.assertEqual(sorted(claimed), ["SN-A", "SN-B", "SN-C", "SN-D"])
+        self.assertEqual(self.claim().status_code, 404)
+
+    def test_priority_and_age_order(self):
+        self.assertEqual([self.claimed() for _ in range(4)], ["SN-C", "SN-B", "SN-D", "SN-A"])
+        ProductSerial.objects.update(claimed_by=None, lease_expires=None)
+        self.assertEqual([self.claimed(order="age") for _ in range(4)], ["SN-D", "SN-A", "SN-C", "SN-B"])
+
+    def test_expired_lease_is_claimed_again(self):
+        serial_no = self.claimed(station="S1")
+        ProductSerial.objects.exclude(serial_no=serial_no).update(status='completed')
+        self.assertEqual(self.claim(station="S2").status_code, 404)
+
+        ProductSerial.objects.filter(serial_no=serial_no).update(lease_expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.claimed(station="S2"), serial_no)
+        self.assertEqual(ProductSerial.objects.get(serial_no=serial_no).claimed_by, "S2")
+
+    def test_release_expired(self):
+        expired, active = self.claimed(), self.claimed()
+        ProductSerial.objects.filter(serial_no=expired).update(lease_expires=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.post('/api/station-queue/release-expired/')
+        self.assertEqual(response.json(), {"released": 1})
+        self.assertIsNone(ProductSerial.objects.get(serial_no=expired).claimed_by)
+        self.assertEqual(ProductSerial.objects.get(serial_no=active).claimed_by, "S1")
+
+    def test_rejects_malformed_fields(self):
+        self.assertEqual(self.claim(product_id="abc").status_code, 400)
+        self.assertEqual(self.claim(lease_seconds=0).status_code, 400)
+        self.assertEqual(self.claim(lease_seconds=-60).status_code, 400)
+        self.assertFalse(ProductSerial.objects.filter(claimed_by__isnull=False).exists())
+        self.assertEqual(self.claimed(product_id=str(self.category.id)), "SN-C")
+
+
+class CategoryCloneTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=3, subtasks=2, serials=2)
+        cls.category = ProductCategory.objects.get()
+        cls.tasks = list(cls.category.tasks.order_by('id'))
+
+    def test_clone_with_renames_and_exclusions(self):
+        first, second, third = self.tasks
+        renamed = first.subtasks.order_by('id').first()
+        skipped = second.subtasks.order_by('id').first()
+        response = self.client.post(f'/api/categories/{self.category.id}/clone/', {
+            "name": "Variant B",
+            "task_names": {str(first.id): "Inspection"},
+            "subtask_names": {str(renamed.id): "Torque check"},
+            "exclude_tasks": [third.id],
+            "exclude_subtasks": [skipped.id],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+
+        clone = ProductCategory.objects.get(pk=data["category"]["id"])
+        self.assertEqual(clone.name, "Variant B")
+        self.assertEqual(sorted(data["tasks"]), sorted([str(first.id), str(second.id)]))
+        self.assertEqual(Task.objects.get(pk=data["tasks"][str(first.id)]).name, "Inspection")
+        self.assertEqual(SubTask.objects.get(pk=data["subtasks"][str(renamed.id)]).name, "Torque check")
+        self.assertNotIn(str(skipped.id), data["subtasks"])
+        self.assertEqual(SubTask.objects.filter(task__category=clone).count(), 3)
+        self.assertFalse(clone.product_serials.exists())
+
+    def test_rejects_invalid_names(self):
+        first = self.tasks[0]
+        for body in [
+            {"name": None},
+            {"name": ""},
+            {"name": "x" * 101},
+            {"task_names": {str(first.id): None}},
+            {"subtask_names": {str(first.subtasks.first().id): 42}},
+            {"description": None},
+            {"description": ["x"]},
+        ]:
+            response = self.client.post(f'/api/categories/{self.category.id}/clone/', body,
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(ProductCategory.objects.count(), 1)
+
+
+class StatusWriteCoalescerTests(TransactionTestCase):
+    """The coalescer commits from its own thread, so the rows must really be committed"""
+    databases = DATABASES
+
+    def setUp(self):
+        seed(categories=1, tasks=2, subtasks=3, serials=4)
+        self.coalescer = coalescer.StatusWriteCoalescer(max_delay_ms=200)
+        patcher = mock.patch.object(coalescer, '_coalescer', self.coalescer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_concurrently(self, bodies):
+        responses = [None] * len(bodies)
+
+        def post(i):
+            try:
+                responses[i] = Client().post('/api/subtask-status-update/', bodies[i],
+                                             content_type='application/json')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(len(bodies))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    @override_settings(STATUS_WRITE_COALESCER={'ENABLED': True})
+    def test_concurrent_requests_share_batches(self):
+        serials = list(ProductSerial.objects.order_by('serial_no').values_list('serial_no', flat=True))
+        bodies = [
+            {"serial_no": serial_no, "updates": [
+                {"id": pk, "status": "Not_OK", "updated_by": f"Station {i}", "remark": "scratched"}
+                for pk in SerialSubTaskStatus.objects.filter(product_serial_id=serial_no).values_list('id', flat=True)
+            ]}
+            for i, serial_no in enumerate(serials)
+        ]
+        responses = self.post_concurrently(bodies)
+
+        self.assertEqual([r.status_code for r in responses], [200] * len(bodies))
+        self.assertEqual([r.json()["updated_count"] for r in responses], [6] * len(bodies))
+        self.assertLess(self.coalescer.batches_committed, len(bodies))
+        self.assertFalse(SerialSubTaskStatus.objects.exclude(status='Not_OK').exists())
+        self.assertFalse(SerialSubTaskStatus.objects.filter(first_status__isnull=True).exists())
+
+        incremental = rollup_rows()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(incremental, rollup_rows())
+
+    @override_settings(STATUS_WRITE_COALESCER={'ENABLED': True})
+    def test_idempotent_requests_use_the_coalescer(self):
+        serial_no, pk = SerialSubTaskStatus.objects.values_list('product_serial_id', 'id').first()
+        body = {"serial_no": serial_no, "updates": [{"id": pk, "status": "OK", "updated_by": "QA"}]}
+        for replayed in (False, True):
+            response = Client().post('/api/subtask-status-update/', body, content_type='application/json',
+                                     headers={"Idempotency-Key": "coalesced-1"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.has_header("Idempotent-Replayed"), replayed)
+        self.assertEqual(self.coalescer.batches_committed, 1)
+
+    def test_last_writer_wins(self):
+        record = SerialSubTaskStatus.objects.filter(status='pending').first()
+        now = timezone.now()
+        self.coalescer.submit([
+            coalescer.StatusWrite(id=record.pk, status='Not_OK', updated_by='A', update_time=now, remark='first'),
+            coalescer.StatusWrite(id=record.pk, status='OK', updated_by='B', update_time=now),
+        ])
+        record.refresh_from_db()
+        self.assertEqual(
+            (record.status, record.first_status, record.updated_by, record.remark),
+            ('OK', 'Not_OK', 'B', 'first'),
+        )
+
+
+class IdempotencyTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=2, serials=1)
+        cls.serial = ProductSerial.objects.get()
+        cls.record = cls.serial.serial_subtasks.filter(status='pending').first()
+
+    def post(self, status_value, key="key-1"):
+        return self.client.post('/api/subtask-status-update/', {"serial_no": self.serial.serial_no, "updates": [
+            {"id": self.record.pk, "status": status_value, "updated_by": "QA"},
+        ]}, content_type='application/json', headers={"Idempotency-Key": key})
+
+    def test_writes_roll_back_when_the_key_cannot_be_stored(self):
+        update = QuerySet.update
+
+        def fail_for_keys(queryset, **kwargs):
+            if queryset.model is IdempotencyKey:
+                raise OperationalError("disk I/O error")
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', fail_for_keys):
+            with self.assertRaises(OperationalError):
+                self.post("OK")
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.status, 'pending')
+        self.assertEqual(self.post("OK").status_code, 200)
+
+    def test_replay_and_different_body(self):
+        first = self.post("Not_OK")
+        replay = self.post("Not_OK")
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(self.post("OK").status_code, 422)
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.status, 'Not_OK')
+
+    def test_retry_while_the_first_request_is_running(self):
+        body = {"serial_no": self.serial.serial_no, "updates": [
+            {"id": self.record.pk, "status": "OK", "updated_by": "QA"},
+        ]}
+        request_hash = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+        pending = IdempotencyKey.objects.create(
+            endpoint='/api/subtask-status-update/', key="key-1", request_hash=request_hash, created_at=timezone.now(),
+        )
+        response = self.post("OK")
+        self.assertEqual(response.status_code, 409)
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.status, 'pending')
+
+        # Still pending after the timeout: the first request died, so the retry runs
+        IdempotencyKey.objects.filter(pk=pending.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.post("OK").status_code, 200)
+        self.assertEqual(self.post("OK")["Idempotent-Replayed"], "true")
+        self.assertEqual(IdempotencyKey.objects.get(key="key-1").status_code, 200)
+
+
+class DenormalizedKeyTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=2, tasks=2, subtasks=2, serials=2)
+        cls.category, cls.other = ProductCategory.objects.order_by('id')
+
+    def assertKeysMatchJoins(self):
+        mismatched = SerialSubTaskStatus.objects.exclude(
+            task_id=F('subtask__task_id'), category_id=F('subtask__task__category_id')
+        )
+        self.assertFalse(mismatched.exists())
+
+    def test_materialized_rows(self):
+        serial = ProductSerial.objects.create(serial_no="SN-NEW", product=self.category, product_name="New")
+        self.client.get('/api/subtasks-by-serial/', {"serial_number": serial.serial_no})
+        self.assertEqual(serial.serial_subtasks.filter(category=self.category).count(), 4)
+        self.assertKeysMatchJoins()
+
+    def test_subtask_and_task_moves(self):
+        subtask = SubTask.objects.filter(task__category=self.category).first()
+        subtask.task = Task.objects.filter(category=self.other).first()
+        subtask.save()
+        self.assertKeysMatchJoins()
+
+        task = Task.objects.filter(category=self.category).first()
+        task.category = self.other
+        task.save()
+        self.assertKeysMatchJoins()
+
+        # Saving without a move leaves the status rows alone
+        subtask = SubTask.objects.get(pk=subtask.pk)
+        subtask.name = "Renamed"
+        with self.assertNumQueries(1):
+            subtask.save()
+
+    def test_status_moved_to_another_subtask(self):
+        record = SerialSubTaskStatus.objects.filter(category=self.category).first()
+        record.subtask = SubTask.objects.filter(task__category=self.other).first()
+        record.save()
+        self.assertKeysMatchJoins()
+
+        record = SerialSubTaskStatus.objects.get(pk=record.pk)
+        record.subtask = SubTask.objects.filter(task__category=self.category).first()
+        record.save(update_fields=['subtask'])
+        self.assertKeysMatchJoins()
+
+    def test_filters_use_covering_index(self):
+        queryset = SerialSubTaskStatus.objects.filter(category=self.category, status='Not_OK').values('update_time')
+        self.assertIn('api_serials_categor', queryset.explain())
+        response = self.client.get('/api/serial-statuses/', {"category": self.category.id, "status": "Not_OK"})
+        self.assertEqual(
+            {row["serial_no"].split("-")[1] for row in response.json()["results"]}, {"0"}
+        )
+
+
+@skipUnless(PLANTS, "needs plant databases, e.g. PQC_PLANTS=north,south")
+class PlantPartitionTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=2, tasks=1, subtasks=2, serials=3)
+        cls.plant, cls.database = next(iter(PLANTS.items()))
+        cls.category, cls.other = ProductCategory.objects.order_by('id')
+
+    def test_catalogue_is_replicated(self):
+        response = self.client.post('/api/categories/', {"name": "New line"}, content_type='application/json')
+        refresh_snapshot()  # what the post-commit catalogue refresh runs
+        self.assertTrue(ProductCategory.objects.using(self.database).filter(pk=response.json()["id"]).exists())
+        self.assertEqual(SubTask.objects.using(self.database).count(), SubTask.objects.count())
+
+    def test_requests_are_routed_by_plant(self):
+        response = self.client.post('/api/product-serials/', {
+            "serial_no": "PLANT-1", "product": self.category.id, "product_name": "Routed",
+        }, content_type='application/json', headers={"X-Plant": self.plant})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(ProductSerial.objects.using(self.database).filter(pk="PLANT-1").exists())
+        self.assertFalse(ProductSerial.objects.filter(pk="PLANT-1").exists())
+
+        response = self.client.get('/api/subtasks-by-serial/', {"serial_number": "PLANT-1", "plant": self.plant})
+        self.assertEqual(len(response.json()["subtask_statuses"]), 2)
+        self.assertEqual(SerialSubTaskStatus.objects.using(self.database).count(), 2)
+
+        # The checklist exists now: a repeat read must not write to the plant database
+        with CaptureQueriesContext(connections[self.database]) as queries:
+            self.client.get('/api/subtasks-by-serial/', {"serial_number": "PLANT-1", "plant": self.plant})
+        self.assertFalse([q for q in queries if not q['sql'].startswith('SELECT')])
+
+        self.assertEqual(self.client.get('/api/categories/', headers={"X-Plant": "nowhere"}).status_code, 400)
+
+    def test_split_existing_database(self):
+        serial_nos = set(self.category.product_serials.values_list('serial_no', flat=True))
+        statuses = SerialSubTaskStatus.objects.filter(product_serial_id__in=serial_nos).count()
+
+        call_command('split_plants', '--assign', f'{self.plant}={self.category.id}', stdout=StringIO())
+
+        self.assertFalse(ProductSerial.objects.filter(serial_no__in=serial_nos).exists())
+        self.assertEqual(
+            set(ProductSerial.objects.using(self.database).values_list('serial_no', flat=True)), serial_nos
+        )
+        self.assertEqual(SerialSubTaskStatus.objects.using(self.database).count(), statuses)
+        self.assertTrue(StatusRollup.objects.using(self.database).exists())
+
+    def test_data_migrations_stay_on_their_database(self):
+        # A reworked unit: failed first, OK now
+        reworked = SerialSubTaskStatus.objects.order_by('id').first()
+        SerialSubTaskStatus.objects.filter(pk=reworked.pk).update(status='OK', first_status='Not_OK', task=None)
+        schema_editor = mock.Mock(connection=connections[self.database])
+
+        for module, function in (('0019_status_rollups', 'backfill_first_status'),
+                                 ('0023_serialsubtaskstatus_task_category', 'backfill_task_category')):
+            migration = importlib.import_module(f'api.migrations.{module}')
+            getattr(migration, function)(django_apps, schema_editor)
+
+        reworked.refresh_from_db()
+        self.assertEqual((reworked.first_status, reworked.task_id), ('Not_OK', None))
+
+
+@override_settings(BATCH_READ_WORKERS=1)
+class BatchTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=2, serials=2)
+        cls.serial = ProductSerial.objects.order_by('serial_no').first()
+        cls.status_ids = list(cls.serial.serial_subtasks.order_by('id').values_list('id', flat=True))
+
+    def batch(self, requests, **options):
+        response = self.client.post('/api/batch/', {"requests": requests, **options}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def update(self, status_id, value):
+        return {"method": "POST", "path": "/api/subtask-status-update/", "body": {
+            "serial_no": self.serial.serial_no, "updates": [{"id": status_id, "status": value, "updated_by": "QA"}],
+        }}
+
+    def test_responses_in_order(self):
+        result = self.batch([
+            self.update(self.status_ids[0], "Not_OK"),
+            {"method": "GET", "path": f"/api/subtasks-by-serial/?serial_number={self.serial.serial_no}"},
+            {"method": "GET", "path": "/api/nowhere/"},
+            {"method": "GET", "path": "/admin/"},
+            {"method": "POST", "path": "/api/batch/", "body": {"requests": []}},
+        ])
+        self.assertEqual([r["status"] for r in result["responses"]], [200, 200, 404, 400, 400])
+        statuses = result["responses"][1]["body"]["subtask_statuses"]
+        self.assertEqual(statuses[0]["status"], "Not_OK")
+
+    def test_atomic_rolls_back_on_failure(self):
+        result = self.batch([
+            self.update(self.status_ids[0], "Not_OK"),
+            {"method": "GET", "path": "/api/product-serials/NO-SUCH-SERIAL/"},
+            self.update(self.status_ids[1], "OK"),
+        ], atomic=True)
+        self.assertTrue(result["rolled_back"])
+        self.assertEqual([r["status"] for r in result["responses"]], [200, 404, 424])
+        self.assertFalse(SerialSubTaskStatus.objects.filter(pk=self.status_ids[0], status="Not_OK").exists())
+
+    def test_delete_and_streaming_sub_requests(self):
+        user = User.objects.first()
+        result = self.batch([
+            {"method": "DELETE", "path": f"/api/users/{user.pk}/"},
+            {"method": "GET", "path": f"/api/users/{user.pk}/"},
+        ])
+        self.assertEqual(result["responses"], [
+            {"status": 204, "body": None}, {"status": 404, "body": {"detail": "No User matches the given query."}},
+        ])
+
+        staff = get_user_model().objects.create_user("batch-staff", password="secret", is_staff=True)
+        self.client.force_login(staff)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILING={'DIR': directory}):
+            profile_id = self.client.get('/api/categories/?_profile=cpu')["X-Profile-Id"]
+            result = self.batch([{"method": "GET", "path": f"/api/profiles/{profile_id}/download/"}])
+        self.assertEqual(result["responses"][0]["status"], 200)
+        self.assertIsInstance(result["responses"][0]["body"], str)
+
+    def test_rejects_malformed_batches(self):
+        for body in ({}, {"requests": []}, {"requests": ["GET /api/users/"]}, {"requests": [{}] * 51}):
+            response = self.client.post('/api/batch/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_malformed_headers_fail_only_their_item(self):
+        response = self.client.post('/api/batch/', {"requests": [
+            {"method": "GET", "path": "/api/users/", "headers": ["x"]},
+            {"method": "GET", "path": "/api/users/", "headers": "x"},
+            {"method": "GET", "path": "/api/users/", "headers": {"Accept": "application/json"}},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in response.json()["responses"]], [400, 400, 200])
+
+
+class BatchConcurrentReadTests(TransactionTestCase):
+    """Consecutive GETs run on the thread pool, which needs committed rows"""
+    databases = DATABASES
+
+    def test_parallel_reads_match_sequential(self):
+        seed(categories=2, tasks=1, subtasks=2, serials=3)
+        requests = [
+            {"method": "GET", "path": f"/api/product-serials/by-product/?product_id={category_id}"}
+            for category_id in ProductCategory.objects.values_list('id', flat=True)
+        ] + [{"method": "GET", "path": "/api/categories/"}]
+
+        parallel = self.client.post('/api/batch/', {"requests": requests}, content_type='application/json').json()
+        with override_settings(BATCH_READ_WORKERS=1):
+            sequential = self.client.post('/api/batch/', {"requests": requests}, content_type='application/json').json()
+        self.assertEqual([r["status"] for r in parallel["responses"]], [200, 200, 200])
+        self.assertEqual(parallel, sequential)
+
+
+class BackupUnderTrafficTests(TransactionTestCase):
+    """backup_db copies a real file database while the API keeps writing statuses to it"""
+    databases = DATABASES
+
+    def setUp(self):
+        seed(categories=1, tasks=2, subtasks=5, serials=100)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+        # The test database is in memory: copy it into a file and point 'default' at that. The in-memory
+        # database only lives while a connection to it is open, so one is kept until 'default' is back on it
+        memory = sqlite3.connect(connection.settings_dict['NAME'], uri=True)
+        self.addCleanup(memory.close)
+        live = sqlite3.connect(self.directory / 'live.sqlite3')
+        memory.backup(live)
+        live.close()
+
+        self.addCleanup(connection.ensure_connection)
+        patcher = mock.patch.dict(connection.settings_dict, {'NAME': str(self.directory / 'live.sqlite3')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        connection.close()
+        self.addCleanup(connection.close)
+
+    def test_status_writes_during_backup(self):
+        serial = ProductSerial.objects.order_by('serial_no').first()
+        ids = list(serial.serial_subtasks.values_list('id', flat=True))
+        out = self.directory / 'backups'
+        backup = threading.Thread(target=call_command, args=('backup_db',), kwargs=dict(
+            databases=['default'], output_dir=out, pages=8, sleep=0.01, verify=True, stdout=StringIO(),
+        ))
+        responses = []
+
+        backup.start()
+        while backup.is_alive() or not responses:
+            responses.append(self.client.post('/api/subtask-status-update/', {
+                "serial_no": serial.serial_no,
+                "updates": [{"id": i, "status": ("OK", "Not_OK")[len(responses) % 2], "updated_by": "QA"} for i in ids],
+            }, content_type='application/json'))
+        backup.join()
+
+        # A write that hit "database is locked" would have raised (or answered 500) instead
+        self.assertEqual({r.status_code for r in responses}, {200})
+        copy, = out.glob('default-*.sqlite3')
+        self.assertTrue(quick_check(copy))
+        db = sqlite3.connect(copy)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM api_serialsubtaskstatus").fetchone()[0],
+                         SerialSubTaskStatus.objects.count())
+        db.close()
+
+
+class OnlineBackupTests(SimpleTestCase):
+    """Runs against a real file database: the test database is in memory"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.source = str(self.directory / 'live.sqlite3')
+
+    def make_database(self, rows):
+        db = sqlite3.connect(self.source)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE status (id INTEGER PRIMARY KEY, status TEXT, remark TEXT)")
+        db.executemany("INSERT INTO status (status, remark) VALUES ('pending', ?)",
+                       ((f"{i:0100d}",) for i in range(rows)))
+        db.commit()
+        db.close()
+
+    def test_compressed_checksummed_snapshots_with_retention(self):
+        self.make_database(100)
+        out = self.directory / 'backups'
+        for _ in range(3):
+            target = snapshot(self.source, out, 'default', compress=True, checksum=True, pages=-1)
+        oldest = sorted(out.glob('default-*.gz'))[0]
+        self.assertEqual(prune(out, 'default', keep=2), [oldest])
+
+        self.assertEqual(len(list(out.glob('default-*.gz'))), 2)
+        self.assertEqual(len(list(out.glob('default-*.sha256'))), 2)
+        digest, name = Path(f'{target}.sha256').read_text().split()
+        self.assertEqual((digest, name), (sha256_file(target), target.name))
+        with gzip.open(target) as packed:
+            self.assertEqual(packed.read(16), b'SQLite format 3\x00')
+
+
+class ProfilingTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=2, serials=2)
+        cls.staff = get_user_model().objects.create_user('admin', password='secret', is_staff=True)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiling_settings = override_settings(PROFILING={'DIR': directory.name, 'KEEP': 2, 'TOP': 5})
+        profiling_settings.enable()
+        self.addCleanup(profiling_settings.disable)
+
+    def test_staff_cpu_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/categories/?_profile=cpu')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Profile-Queries"], "4")
+
+        profile = self.client.get(f'/api/profiles/{response["X-Profile-Id"]}/').json()
+        self.assertEqual((profile["kind"], profile["status"], profile["query_count"]), ("cpu", 200, 4))
+        self.assertEqual(len(profile["functions"]), 5)
+        self.assertIn("api_productcategory", profile["queries"][0]["sql"])
+
+        download = self.client.get(f'/api/profiles/{profile["id"]}/download/')
+        self.assertEqual(download.status_code, 200)
+        self.assertGreater(len(b"".join(download.streaming_content)), 0)
+
+    def test_staff_mem_profile_via_header(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/product-serials/', headers={"X-Profile": "mem"})
+        profile = self.client.get(f'/api/profiles/{response["X-Profile-Id"]}/').json()
+        self.assertIn("allocations", profile)
+        self.assertNotIn("functions", profile)
+        self.assertEqual(self.client.get(f'/api/profiles/{profile["id"]}/download/').status_code, 404)
+
+    def test_overlapping_mem_profiles(self):
+        second_started, first_done = threading.Event(), threading.Event()
+        summaries, errors = {}, []
+
+        def first(request):
+            second_started.wait(5)
+            return HttpResponse()
+
+        def second(request):
+            second_started.set()
+            first_done.wait(5)  # still running when the first profile finishes
+            blocks = [bytearray(1024) for _ in range(100)]
+            return HttpResponse(len(blocks))
+
+        def run(name, get_response):
+            try:
+                summaries[name] = profiling.profile_request(RequestFactory().get('/api/users/'), get_response, 'mem')[1]
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                if name == 'first':
+                    first_done.set()
+
+        threads = [threading.Thread(target=run, args=args) for args in (('first', first), ('second', second))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(summaries), ['first', 'second'])
+        self.assertTrue(summaries['second']['allocations'])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_only_staff_can_profile(self):
+        response = self.client.get('/api/categories/?_profile=cpu')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+
+    def test_sampling_and_rotation(self):
+        with override_settings(PROFILING={**settings.PROFILING, 'SAMPLE_RATE': 1.0}):
+            for _ in range(3):
+                self.assertNotIn("X-Profile-Id", self.client.get('/api/users/'))
+            self.client.force_login(self.staff)
+            self.assertEqual(len(self.client.get('/api/profiles/').json()), 2)
+
+
+class WarmupTests(TestCase):
+    databases = DATABASES
+
+    def test_prime_process(self):
+        self.assertGreater(warmup.prime_process(), 0)
+
+    def test_catalogue_diffs_are_cached(self):
+        category = ProductCategory.objects.create(name="Chassis")
+        first = refresh_snapshot()
+        Task.objects.create(category=category, name="Weld")
+        latest = refresh_snapshot()
+
+        self.assertEqual(warmup.prime_catalogue(0), 0)
+        self.assertEqual(warmup.prime_catalogue(5), latest.version - first.version)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cached_diff(first.version, latest)["tasks"]["upsert"]), 1)
+
+    def test_every_pool_thread_is_primed(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            primed = warmup.on_each_thread(pool, 4, threading.get_ident)
+            served = pool.submit(threading.get_ident).result()
+        self.assertEqual(len(set(primed)), 4)
+        self.assertIn(served, primed)
+
+
+class MetricsTests(TestCase):
+    databases = DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(categories=1, tasks=1, subtasks=2, serials=1)
+        cls.serial = ProductSerial.objects.get()
+        cls.status_ids = list(cls.serial.serial_subtasks.order_by('id').values_list('id', flat=True))
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_query_and_status_counts(self):
+        route = {"view": "productcategory-list", "method": "GET"}
+        requests = self.sample('pqc_http_requests_total', status="200", **route)
+        latencies = self.sample('pqc_http_request_duration_seconds_count', **route)
+        reads = self.sample('pqc_db_queries_total', database="default", operation="read")
+        not_ok = self.sample('pqc_status_updates_total', status="Not_OK")
+
+        self.client.get('/api/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/subtask-status-update/', {"serial_no": self.serial.serial_no, "updates": [
+                {"id": status_id, "status": "Not_OK", "updated_by": "QA"} for status_id in self.status_ids
+            ]}, content_type='application/json')
+
+        self.assertEqual(self.sample('pqc_http_requests_total', status="200", **route), requests + 1)
+        self.assertEqual(self.sample('pqc_http_request_duration_seconds_count', **route), latencies + 1)
+        self.assertGreaterEqual(self.sample('pqc_db_queries_total', database="default", operation="read"), reads + 4)
+        self.assertEqual(self.sample('pqc_status_updates_total', status="Not_OK"), not_ok + 2)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pqc_http_requests_total{method="GET",status="200",view="productcategory-list"}',
+                      response.content.decode())
+
+    def test_busy_errors_are_counted(self):
+        busy = self.sample('pqc_db_busy_errors_total', database="default")
+
+        def locked(sql, params, many, context):
+            raise OperationalError("database is locked")
+
+        with self.assertRaises(OperationalError):
+            metrics.record_query(locked, "UPDATE api_productcategory SET name = %s", ["x"], False,
+                                 {"connection": connection})
+        self.assertEqual(self.sample('pqc_db_busy_errors_total', database="default"), busy + 1)
+
+    @override_settings(METRICS={'TOKEN': 's3cret'})
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={"Authorization": "Bearer s3cret"}).status_code, 200)
@@ -6,9 +6,17 @@ from .views import (
     TaskViewSet,
     SubTaskViewSet,
     ProductSerialViewSet,
+    DeletionJobViewSet,
+    SerialSubTaskStatusViewSet,
+    AnalyticsViewSet,
+    StationQueueViewSet,
     UserLoginAPIView,
     SubTasksBySerial,          # ✅ include this
-    SubTaskStatusUpdateView
+    SubTaskStatusUpdateView,
+    SerialTaskStatusView,
+    CatalogueSnapshotView,
+    BatchView,
+    ProfileViewSet
 )
 
 # ------------------------------
@@ -20,11 +28,19 @@ router.register(r'categories', ProductCategoryViewSet)
 router.register(r'tasks', TaskViewSet)
 router.register(r'subtasks', SubTaskViewSet)
 router.register(r'product-serials', ProductSerialViewSet)
+router.register(r'deletion-jobs', DeletionJobViewSet)
+router.register(r'serial-statuses', SerialSubTaskStatusViewSet)
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+router.register(r'station-queue', StationQueueViewSet, basename='station-queue')
+router.register(r'profiles', ProfileViewSet, basename='profiles')
 
 urlpatterns = [
     path('', include(router.urls)),  # keep this as is
     path('login/', UserLoginAPIView.as_view(), name='user-login'),
     path('subtask-status-update/', SubTaskStatusUpdateView.as_view(), name='subtask-status-update'),
+    path('serial-task-status/', SerialTaskStatusView.as_view(), name='serial-task-status'),
+    path('catalogue/', CatalogueSnapshotView.as_view(), name='catalogue-snapshot'),
+    path('batch/', BatchView.as_view(), name='batch'),
 
     # ✅ Add this line
     path('subtasks-by-serial/', SubTasksBySerial.as_view(), name='subtasks-by-serial'),
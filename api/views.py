@@ -1,10 +1,21 @@
-from rest_framework import viewsets, status
+from rest_framework import serializers, viewsets, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAdminUser
+from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth import authenticate, login
+from django.http import FileResponse, HttpResponse
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.db import transaction
+from django.conf import settings
+from django.db.models import F, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+import json
 
 
 from .models import (
@@ -13,8 +24,15 @@ from .models import (
     Task,
     SubTask,
     ProductSerial,
-    SerialSubTaskStatus  # ✅ new model for serial-based subtask status
+    SerialSubTaskStatus,  # ✅ new model for serial-based subtask status
+    ArchivedProductSerial,
+    StatusRollup,
+    DeletionJob
 )
+from .filters import SerialSubTaskStatusFilter
+from .idempotency import idempotent
+from .routers import current_database
+from . import batch, catalogue, coalescer, deletion, fast_reads, metrics, profiling, rollups
 from .serializers import (
     UserSerializer,
     UserLoginSerializer,
@@ -22,7 +40,10 @@ from .serializers import (
     TaskSerializer,
     SubTaskSerializer,
     ProductSerialSerializer,
-    SerialSubTaskStatusSerializer  # ✅ new serializer
+    SerialSubTaskStatusSerializer,  # ✅ new serializer
+    ArchivedSerialSubTaskStatusSerializer,
+    DeletionJobSerializer,
+    resolve_updated_by
 )
 
 
@@ -40,16 +61,106 @@ class UserViewSet(viewsets.ModelViewSet):
 # ------------------------------
 class ProductCategoryViewSet(viewsets.ModelViewSet):
     """CRUD operations for Product Categories (with nested tasks & subtasks)"""
-    queryset = ProductCategory.objects.all()
+    queryset = ProductCategory.objects.filter(deleting=False).prefetch_related(
+        'tasks__subtasks',
+        Prefetch(
+            'tasks__subtasks__product_serials',
+            queryset=ProductSerial.objects.filter(deleting=False).select_related('product'),
+        ),
+    )
     serializer_class = ProductCategorySerializer
 
+    def destroy(self, request, *args, **kwargs):
+        """?mode=chunked removes the category in the background instead of one big cascade"""
+        if request.query_params.get('mode') != 'chunked':
+            return super().destroy(request, *args, **kwargs)
+
+        category = self.get_object()
+        job = deletion.create_job('category', category.id)
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'])
+    def clone(self, request, pk=None):
+        """
+        Copy this category's task / subtask template into a new category.
+        Body: name, description, task_names / subtask_names ({old_id: new_name}),
+        exclude_tasks / exclude_subtasks ([old_id, ...]).
+        """
+        try:
+            source = ProductCategory.objects.get(pk=pk, deleting=False)
+        except (ProductCategory.DoesNotExist, ValueError):
+            return Response({"error": "Category not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        name = request.data.get("name", f"{source.name} (copy)")
+        task_names = request.data.get("task_names") or {}
+        subtask_names = request.data.get("subtask_names") or {}
+        exclude_tasks = request.data.get("exclude_tasks") or []
+        exclude_subtasks = request.data.get("exclude_subtasks") or []
+
+        if not isinstance(task_names, dict) or not isinstance(subtask_names, dict):
+            return Response({"error": "task_names and subtask_names must be objects"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(exclude_tasks, list) or not isinstance(exclude_subtasks, list):
+            return Response({"error": "exclude_tasks and exclude_subtasks must be lists"}, status=status.HTTP_400_BAD_REQUEST)
+        invalid = [
+            n for n in [name, *task_names.values(), *subtask_names.values()]
+            if not isinstance(n, str) or not n.strip() or len(n) > 100
+        ]
+        if invalid:
+            return Response(
+                {"error": f"Names must be non-empty strings of at most 100 characters: {invalid}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        description = request.data.get("description", source.description)
+        if not isinstance(description, str):
+            return Response({"error": "description must be a string"}, status=status.HTTP_400_BAD_REQUEST)
+
+        exclude_tasks = {str(i) for i in exclude_tasks}
+        exclude_subtasks = {str(i) for i in exclude_subtasks}
+
+        with transaction.atomic():
+            category = ProductCategory.objects.create(
+                name=name, description=description
+            )
+
+            tasks = [t for t in source.tasks.order_by('id') if str(t.id) not in exclude_tasks]
+            new_tasks = Task.objects.bulk_create([
+                Task(category=category, name=task_names.get(str(t.id), t.name)) for t in tasks
+            ])
+            task_map = {old.id: new.id for old, new in zip(tasks, new_tasks)}
+
+            subtasks = [
+                s for s in SubTask.objects.filter(task_id__in=task_map).order_by('id')
+                if str(s.id) not in exclude_subtasks
+            ]
+            new_subtasks = SubTask.objects.bulk_create([
+                SubTask(
+                    task_id=task_map[s.task_id],
+                    name=subtask_names.get(str(s.id), s.name),
+                    description=s.description,
+                ) for s in subtasks
+            ])
+
+            # bulk_create sends no post_save signals
+            catalogue.schedule_refresh()
+
+        return Response({
+            "category": {"id": category.id, "name": category.name},
+            "tasks": task_map,
+            "subtasks": {old.id: new.id for old, new in zip(subtasks, new_subtasks)},
+            "message": f"Cloned {source.name} into {category.name}"
+        }, status=status.HTTP_201_CREATED)
+
 
 # ------------------------------
 # TASK VIEWSET
 # ------------------------------
 class TaskViewSet(viewsets.ModelViewSet):
     """CRUD operations for Tasks (linked to Product Categories)"""
-    queryset = Task.objects.all()
+    queryset = Task.objects.filter(category__deleting=False).select_related('category').prefetch_related(
+        'subtasks',
+        Prefetch('subtasks__product_serials', queryset=ProductSerial.objects.filter(deleting=False).select_related('product')),
+    )
     serializer_class = TaskSerializer
 
 
@@ -58,7 +169,9 @@ class TaskViewSet(viewsets.ModelViewSet):
 # ------------------------------
 class SubTaskViewSet(viewsets.ModelViewSet):
     """CRUD operations for SubTasks"""
-    queryset = SubTask.objects.all()
+    queryset = SubTask.objects.filter(task__category__deleting=False).select_related('task').prefetch_related(
+        Prefetch('product_serials', queryset=ProductSerial.objects.filter(deleting=False).select_related('product'))
+    )
     serializer_class = SubTaskSerializer
 
     # ✅ Update only the status of a subtask
@@ -75,7 +188,7 @@ class SubTaskViewSet(viewsets.ModelViewSet):
             )
 
         subtask.status = new_status
-        subtask.save()
+        subtask.save(update_fields=['status'])
 
         return Response({
             'message': 'Status updated successfully',
@@ -97,7 +210,7 @@ class SubTaskViewSet(viewsets.ModelViewSet):
         except Task.DoesNotExist:
             return Response({"error": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        subtasks = SubTaskSerializer(task.subtasks.all(), many=True).data
+        subtasks = fast_reads.subtasks(task.subtasks.all())
         return Response({
             "task_id": task.id,
             "task_name": task.name,
@@ -110,7 +223,7 @@ class SubTaskViewSet(viewsets.ModelViewSet):
 # ------------------------------
 class ProductSerialViewSet(viewsets.ModelViewSet):
     """CRUD operations for Product Serials"""
-    queryset = ProductSerial.objects.all()
+    queryset = ProductSerial.objects.filter(deleting=False).select_related('product', 'subtask')
     serializer_class = ProductSerialSerializer
 
     def create(self, request, *args, **kwargs):
@@ -121,6 +234,11 @@ class ProductSerialViewSet(viewsets.ModelViewSet):
                 {"error": f"Serial number '{serial_no}' already exists."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if ArchivedProductSerial.objects.filter(serial_no=serial_no).exists():
+            return Response(
+                {"error": f"Serial number '{serial_no}' already exists in the archive."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return super().create(request, *args, **kwargs)
 
     @action(detail=False, methods=['get'], url_path='by-product')
@@ -133,9 +251,345 @@ class ProductSerialViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        serials = ProductSerial.objects.filter(product_id=product_id)
-        serializer = ProductSerialSerializer(serials, many=True)
-        return Response(serializer.data)
+        serials = ProductSerial.objects.filter(product_id=product_id, deleting=False)
+        return Response(fast_reads.product_serials(serials))
+
+    def destroy(self, request, *args, **kwargs):
+        """?mode=chunked removes the serial and its statuses in the background"""
+        if request.query_params.get('mode') != 'chunked':
+            return super().destroy(request, *args, **kwargs)
+
+        job = deletion.create_job('serials', [self.get_object().serial_no])
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """Delete a batch of serials (body: serial_nos) in the background"""
+        serial_nos = request.data.get("serial_nos")
+        if not serial_nos or not isinstance(serial_nos, list):
+            return Response({"error": "serial_nos must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        existing = list(self.get_queryset().filter(serial_no__in=serial_nos).values_list('serial_no', flat=True))
+        if not existing:
+            return Response({"error": "No matching product serials"}, status=status.HTTP_404_NOT_FOUND)
+
+        job = deletion.create_job('serials', existing)
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+# ------------------------------
+# DELETION JOB VIEWSET (progress of chunked deletions)
+# ------------------------------
+class DeletionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = DeletionJob.objects.order_by('-id')
+    serializer_class = DeletionJobSerializer
+
+
+# ------------------------------
+# SERIAL SUBTASK STATUS VIEWSET (read-only, filterable)
+# ------------------------------
+class SerialStatusPagination(LimitOffsetPagination):
+    default_limit = 100
+    max_limit = 1000
+
+
+class SerialSubTaskStatusViewSet(viewsets.ReadOnlyModelViewSet):
+    """Query statuses across serials by status, category, task, subtask, updated_by and update_time range"""
+    queryset = SerialSubTaskStatus.objects.filter(product_serial__deleting=False).select_related(
+        'product_serial__product', 'subtask__task'
+    ).order_by('-update_time', '-id')
+    serializer_class = SerialSubTaskStatusSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SerialSubTaskStatusFilter
+    pagination_class = SerialStatusPagination
+
+
+# ------------------------------
+# STORED REQUEST PROFILES (staff only, see profiling.py)
+# ------------------------------
+class ProfileViewSet(viewsets.ViewSet):
+    """Profiles written by ProfilingMiddleware; /download/ returns the cProfile stats for snakeviz / pstats"""
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        return Response(profiling.stored_profiles())
+
+    def retrieve(self, request, pk=None):
+        path = profiling.profile_path(pk, '.json')
+        if path is None or not path.exists():
+            return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(json.loads(path.read_text()))
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        path = profiling.profile_path(pk, '.prof')
+        if path is None or not path.exists():
+            return Response({"error": "No cProfile stats for this profile"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
+
+
+# ------------------------------
+# BATCH (several API calls in one round-trip)
+# ------------------------------
+class BatchView(APIView):
+    """
+    Body: {"requests": [{"method", "path", "body", "headers"}, ...], "atomic": false}.
+    Returns the sub-responses in order. With "atomic": true all sub-requests run in one
+    transaction that is rolled back (and the rest skipped) as soon as one returns >= 400.
+    """
+    def post(self, request):
+        items = request.data.get("requests")
+        atomic = bool(request.data.get("atomic", False))
+        max_requests = getattr(settings, 'BATCH_MAX_REQUESTS', 50)
+
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            return Response({"error": "requests must be a non-empty list of objects"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > max_requests:
+            return Response({"error": f"At most {max_requests} requests per batch"}, status=status.HTTP_400_BAD_REQUEST)
+
+        responses, rolled_back = batch.run_batch(request._request, items, BatchView, atomic=atomic)
+        return Response({"atomic": atomic, "rolled_back": rolled_back, "responses": responses})
+
+
+# ------------------------------
+# PROMETHEUS METRICS (see metrics.py)
+# ------------------------------
+def metrics_view(request):
+    """Prometheus text format, summed over all gunicorn workers; needs the bearer token when METRICS['TOKEN'] is set"""
+    token = metrics.config()['TOKEN']
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse("Invalid metrics token\n", status=401, content_type='text/plain')
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
+
+
+# ------------------------------
+# CATALOGUE SNAPSHOT (flat categories / tasks / subtasks for tablets)
+# ------------------------------
+class CatalogueSnapshotView(APIView):
+    """
+    Compact, versioned catalogue without product serials.
+    Pass ?since=<version> to receive only the changes made after that version.
+    """
+    def get(self, request):
+        snapshot = catalogue.latest_snapshot() or catalogue.refresh_snapshot()
+        data = {"version": snapshot.version, "fields": catalogue.FIELDS}
+
+        since = request.query_params.get("since")
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({"error": "since must be a version number"}, status=status.HTTP_400_BAD_REQUEST)
+
+            if since == snapshot.version:
+                return Response({**data, "unchanged": True})
+            changes = catalogue.cached_diff(since, snapshot) if since < snapshot.version else None
+            if changes is not None:
+                return Response({**data, "since": since, "diff": changes})
+
+        # Unknown / pruned version: send everything
+        return Response({**data, "full": snapshot.payload})
+
+
+# ------------------------------
+# STATION WORK QUEUE
+# ------------------------------
+class StationQueueViewSet(viewsets.ViewSet):
+    """
+    Stations claim pending product serials one at a time. A claim is a single
+    conditional UPDATE, so two stations can never get the same serial; a claim
+    that is not released before its lease expires becomes claimable again.
+    """
+
+    ORDERINGS = {
+        'priority': ('-priority', 'created_at'),
+        'age': ('created_at',),
+    }
+
+    @action(detail=False, methods=['post'])
+    def claim(self, request):
+        """Claim the next pending serial. Body: station, optional order (priority|age), lease_seconds, product_id"""
+        station = request.data.get("station")
+        order = request.data.get("order", "priority")
+        if not station:
+            return Response({"error": "station is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if order not in self.ORDERINGS:
+            return Response({"error": f"order must be one of {list(self.ORDERINGS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            lease_seconds = int(request.data.get("lease_seconds", settings.STATION_LEASE_SECONDS))
+        except (TypeError, ValueError):
+            return Response({"error": "lease_seconds must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if lease_seconds <= 0:
+            return Response({"error": "lease_seconds must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+        product_id = request.data.get("product_id")
+        if product_id:
+            try:
+                product_id = serializers.IntegerField().to_internal_value(product_id)
+            except serializers.ValidationError:
+                return Response({"error": "product_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        lease_expires = now + timedelta(seconds=lease_seconds)
+        claimable = ProductSerial.objects.filter(
+            Q(claimed_by__isnull=True) | Q(lease_expires__lt=now), status='pending', deleting=False
+        )
+        if product_id:
+            claimable = claimable.filter(product_id=product_id)
+
+        # ✅ Pick and claim in one statement; the outer filter re-checks the row is still free
+        next_serial = claimable.order_by(*self.ORDERINGS[order]).values('serial_no')[:1]
+        claimed = claimable.filter(serial_no=Subquery(next_serial)).update(
+            claimed_by=station, lease_expires=lease_expires
+        )
+        if not claimed:
+            return Response({"message": "No pending product serials"}, status=status.HTTP_404_NOT_FOUND)
+
+        product_serial = ProductSerial.objects.select_related('product', 'subtask').get(
+            claimed_by=station, lease_expires=lease_expires
+        )
+        return Response({
+            "serial": ProductSerialSerializer(product_serial).data,
+            "station": station,
+            "lease_expires": timezone.localtime(lease_expires),
+        })
+
+    @action(detail=False, methods=['post'])
+    def release(self, request):
+        """Give a claimed serial back to the queue. Body: serial_no, station"""
+        serial_no = request.data.get("serial_no")
+        station = request.data.get("station")
+        if not serial_no or not station:
+            return Response({"error": "serial_no and station are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        released = ProductSerial.objects.filter(serial_no=serial_no, claimed_by=station).update(
+            claimed_by=None, lease_expires=None
+        )
+        if not released:
+            return Response({"error": f"'{serial_no}' is not claimed by {station}"}, status=status.HTTP_409_CONFLICT)
+        return Response({"message": f"Released {serial_no}"})
+
+    @action(detail=False, methods=['post'], url_path='release-expired')
+    def release_expired(self, request):
+        """Clear every lease that has run out"""
+        released = ProductSerial.objects.filter(lease_expires__lt=timezone.now()).update(
+            claimed_by=None, lease_expires=None
+        )
+        return Response({"released": released})
+
+
+# ------------------------------
+# ANALYTICS (reads the StatusRollup table only)
+# ------------------------------
+def _parse_bound(value):
+    """Accept a date or datetime query param and return an aware datetime (None if invalid)"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            return None
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """
+    Defect rates and first-pass yield from the hourly / daily rollups.
+    Query params: granularity (hour|day), start, end (date or datetime; default last 30 days).
+    """
+    GROUP_FIELDS = {
+        'subtask': ('subtask', 'subtask__name'),
+        'task': ('subtask__task', 'subtask__task__name'),
+        'category': ('subtask__task__category', 'subtask__task__category__name'),
+    }
+
+    def _rollups(self, request):
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in dict(StatusRollup.GRANULARITY_CHOICES):
+            return None, Response({"error": "granularity must be 'hour' or 'day'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        end = request.query_params.get('end')
+        end = _parse_bound(end) if end else timezone.now()
+        start = request.query_params.get('start')
+        start = _parse_bound(start) if start else (end and end - timedelta(days=30))
+        if start is None or end is None:
+            return None, Response({"error": "start / end must be dates or datetimes"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rollups = StatusRollup.objects.filter(granularity=granularity, bucket__gte=start, bucket__lt=end)
+        for param, field in (('subtask', 'subtask'), ('task', 'subtask__task'), ('category', 'subtask__task__category')):
+            if request.query_params.get(param):
+                try:
+                    rollups = rollups.filter(**{field: int(request.query_params[param])})
+                except ValueError:
+                    return None, Response({"error": f"{param} must be an id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        meta = {"granularity": granularity, "start": timezone.localtime(start), "end": timezone.localtime(end)}
+        return (rollups, meta), None
+
+    @action(detail=False, methods=['get'], url_path='defect-rates')
+    def defect_rates(self, request):
+        """Not_OK rate per bucket, grouped by subtask, task or category (?group_by=)"""
+        group_by = request.query_params.get('group_by', 'subtask')
+        if group_by not in self.GROUP_FIELDS:
+            return Response({"error": f"group_by must be one of {list(self.GROUP_FIELDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        result, error = self._rollups(request)
+        if error:
+            return error
+        rollups, meta = result
+        id_field, name_field = self.GROUP_FIELDS[group_by]
+
+        rows = (
+            rollups.values('bucket', group_id=F(id_field), group_name=F(name_field))
+            .annotate(ok=Sum('ok_count'), not_ok=Sum('not_ok_count'))
+            .order_by('bucket', 'group_id')
+        )
+        results = []
+        for row in rows:
+            checked = row['ok'] + row['not_ok']
+            results.append({
+                "bucket": timezone.localtime(row['bucket']),
+                f"{group_by}_id": row['group_id'],
+                f"{group_by}_name": row['group_name'],
+                "ok": row['ok'],
+                "not_ok": row['not_ok'],
+                "defect_rate": round(row['not_ok'] / checked, 4) if checked else None,
+            })
+
+        return Response({**meta, "group_by": group_by, "results": results})
+
+    @action(detail=False, methods=['get'], url_path='first-pass-yield')
+    def first_pass_yield(self, request):
+        """Share of checks whose first result was OK, per product category and bucket"""
+        result, error = self._rollups(request)
+        if error:
+            return error
+        rollups, meta = result
+
+        rows = (
+            rollups.values(
+                'bucket',
+                category_id=F('subtask__task__category'),
+                category_name=F('subtask__task__category__name'),
+            )
+            .annotate(first_ok=Sum('first_ok_count'), first_not_ok=Sum('first_not_ok_count'))
+            .order_by('bucket', 'category_id')
+        )
+        results = []
+        for row in rows:
+            checked = row['first_ok'] + row['first_not_ok']
+            results.append({
+                "bucket": timezone.localtime(row['bucket']),
+                "category_id": row['category_id'],
+                "category_name": row['category_name'],
+                "first_ok": row['first_ok'],
+                "first_not_ok": row['first_not_ok'],
+                "first_pass_yield": round(row['first_ok'] / checked, 4) if checked else None,
+            })
+
+        return Response({**meta, "results": results})
 
 
 class SubTasksBySerial(APIView):
@@ -149,22 +603,32 @@ class SubTasksBySerial(APIView):
             return Response({"error": "serial_number is required"}, status=400)
 
         try:
-            product_serial = ProductSerial.objects.get(serial_no=serial_number)
+            product_serial = ProductSerial.objects.select_related('product').get(serial_no=serial_number, deleting=False)
         except ProductSerial.DoesNotExist:
-            return Response({"error": "Product Serial not found"}, status=404)
+            return self.get_archived(serial_number)
 
-        # Get all subtasks linked to the same category as the serial’s product
-        subtasks = SubTask.objects.filter(task__category=product_serial.product)
+        serial_statuses = SerialSubTaskStatus.objects.using(current_database()).filter(
+            product_serial=product_serial
+        ).order_by('id')
+        data = fast_reads.serial_statuses(serial_statuses)
 
-        # Ensure status rows exist for this serial & subtasks
-        for s in subtasks:
-            SerialSubTaskStatus.objects.get_or_create(
-                product_serial=product_serial, subtask=s
-            )
+        # Subtasks of the serial’s category that have no status row yet. The catalogue is in 'default' and
+        # the statuses in the plant's database, so the ids are compared here instead of in one query
+        existing = {row['subtask'] for row in data}
+        missing = [
+            (s, t) for s, t in SubTask.objects.filter(task__category_id=product_serial.product_id).values_list('id', 'task_id')
+            if s not in existing
+        ]
 
-            # Re-fetch all statuses after updates
-        serial_statuses = SerialSubTaskStatus.objects.filter(product_serial=product_serial)
-        data = SerialSubTaskStatusSerializer(serial_statuses, many=True).data
+        # Ensure status rows exist for this serial & subtasks
+        if missing:
+            SerialSubTaskStatus.objects.using(current_database()).bulk_create([
+                SerialSubTaskStatus(
+                    product_serial=product_serial, subtask_id=s, task_id=t, category_id=product_serial.product_id
+                )
+                for s, t in missing
+            ], ignore_conflicts=True)
+            data = fast_reads.serial_statuses(serial_statuses.all())
 
         return Response({
              "product_serial": {
@@ -177,9 +641,32 @@ class SubTasksBySerial(APIView):
     "message": f"Fetched subtasks for {serial_number}",
         })
 
+    def get_archived(self, serial_number):
+        """Fall back to the archive tables for serials moved out by `archive_serials`"""
+        try:
+            archived = ArchivedProductSerial.objects.get(serial_no=serial_number)
+        except ArchivedProductSerial.DoesNotExist:
+            return Response({"error": "Product Serial not found"}, status=404)
+
+        serial_statuses = archived.serial_subtasks.select_related('product_serial').order_by('id')
+        data = ArchivedSerialSubTaskStatusSerializer(serial_statuses, many=True).data
+
+        return Response({
+            "product_serial": {
+                "serial_no": archived.serial_no,
+                "product_name": archived.product_name,
+                "category": archived.category_name,
+                "status": archived.status,
+            },
+            "subtask_statuses": data,
+            "archived": True,
+            "message": f"Fetched subtasks for {serial_number}",
+        })
+
     # -------------------------------
     # POST: Update subtask statuses per serial
     # -------------------------------
+    @idempotent
     def post(self, request):
         serial_no = request.data.get("serial_no")
         updates = request.data.get("updates", [])
@@ -188,24 +675,38 @@ class SubTasksBySerial(APIView):
             return Response({"error": "Missing data"}, status=400)
 
         try:
-            product_serial = ProductSerial.objects.get(serial_no=serial_no)
+            product_serial = ProductSerial.objects.get(serial_no=serial_no, deleting=False)
         except ProductSerial.DoesNotExist:
             return Response({"error": "Product Serial not found"}, status=404)
 
+        records = {
+            str(r.subtask_id): r for r in SerialSubTaskStatus.objects.filter(
+                product_serial=product_serial,
+                subtask_id__in=[str(item.get("subtask_id")) for item in updates if str(item.get("subtask_id")).isdigit()]
+            )
+        }
+
         updated = []
-        for item in updates:
-            subtask_id = item.get("subtask_id")
-            value = item.get("value")
+        changes = []
+        with transaction.atomic(using=current_database()):
+            for item in updates:
+                subtask_id = item.get("subtask_id")
+                value = item.get("value")
 
-            try:
-                record = SerialSubTaskStatus.objects.get(
-                    product_serial=product_serial, subtask_id=subtask_id
-                )
-                record.status = value
-                record.save()
-                updated.append({"subtask_id": subtask_id, "status": value})
-            except SerialSubTaskStatus.DoesNotExist:
-                continue
+                try:
+                    record = records[str(subtask_id)]
+                    before = rollups.snapshot(record)
+                    record.status = value
+                    if record.first_status is None and value != 'pending':
+                        record.first_status = value
+                    record.update_time = timezone.now()
+                    record.save()
+                    changes.append((before, rollups.snapshot(record)))
+                    updated.append({"subtask_id": subtask_id, "status": value})
+                except KeyError:
+                    continue
+
+            rollups.apply_changes(changes)
 
         return Response({
             "message": f"Updated subtasks for {serial_no}",
@@ -234,7 +735,11 @@ class UserLoginAPIView(APIView):
 class SubTaskStatusUpdateView(APIView):
     """
     API to update multiple SerialSubTaskStatus records for a given product serial.
+    Send an `Idempotency-Key` header to make client retries safe.
     """
+    coalesced_writes = True  # see idempotency.py
+
+    @idempotent
     def post(self, request):
         serial_no = request.data.get("serial_no")
         updates = request.data.get("updates", [])
@@ -243,54 +748,155 @@ class SubTaskStatusUpdateView(APIView):
             return Response({"error": "Missing serial_no or updates"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            product_serial = ProductSerial.objects.get(serial_no=serial_no)
+            product_serial = ProductSerial.objects.get(serial_no=serial_no, deleting=False)
         except ProductSerial.DoesNotExist:
             return Response({"error": f"Product serial '{serial_no}' not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        updated_count = 0
         errors = []
+        valid = []
+        statuses = SerialSubTaskStatus.objects.in_bulk(
+            [str(u.get("id")) for u in updates if str(u.get("id")).isdigit()]
+        )
+
+        for u in updates:
+            serial_status_id = u.get("id")
+            new_status = u.get("status")
+            updated_by = u.get("updated_by")  # received from Flutter
+            remark = u.get("remark")  # ✅ new optional remark field
+
+            if not serial_status_id or not new_status:
+                errors.append({"id": serial_status_id, "error": "Missing id or status"})
+                continue
 
-        with transaction.atomic():
-            for u in updates:
-                serial_status_id = u.get("id")
-                new_status = u.get("status")
-                updated_by = u.get("updated_by")  # received from Flutter
-                remark = u.get("remark")  # ✅ new optional remark field
-
-                if not serial_status_id or not new_status:
-                    errors.append({"id": serial_status_id, "error": "Missing id or status"})
-                    continue
+            sts = statuses.get(int(serial_status_id)) if str(serial_status_id).isdigit() else None
+            if sts is None:
+                errors.append({"id": serial_status_id, "error": "Not found"})
+                continue
 
-                try:
-                    sts = SerialSubTaskStatus.objects.get(id=serial_status_id)
-                except SerialSubTaskStatus.DoesNotExist:
-                    errors.append({"id": serial_status_id, "error": "Not found"})
-                    continue
+            if sts.product_serial_id != serial_no:
+                errors.append({"id": serial_status_id, "error": "Serial number mismatch"})
+                continue
 
-                if sts.product_serial.serial_no != serial_no:
-                    errors.append({"id": serial_status_id, "error": "Serial number mismatch"})
-                    continue
+            # ✅ Pass updated_by to serializer
+            serializer = SerialSubTaskStatusSerializer(
+                sts,
+                data={
+                    "status": new_status,
+                    "updated_by": updated_by,
+                    "remark": remark
+                },
+                partial=True,
+                context={'request': request}
+            )
 
-                # ✅ Pass updated_by to serializer
-                serializer = SerialSubTaskStatusSerializer(
-                    sts,
-                    data={
-                        "status": new_status,
-                        "updated_by": updated_by,
-                        "remark": remark
-                    },
-                    partial=True,
-                    context={'request': request}
+            if serializer.is_valid():
+                valid.append(serializer)
+            else:
+                errors.append({"id": serial_status_id, "error": serializer.errors})
+
+        write_coalescer = coalescer.get_coalescer()
+        # The coalescer commits from its own thread, so it can't join a transaction held here (atomic batches)
+        if write_coalescer is not None and valid and not transaction.get_connection(current_database()).in_atomic_block:
+            # Group commit with other requests; validation above already ran in this thread
+            now = timezone.now()
+            write_coalescer.submit([
+                coalescer.StatusWrite(
+                    id=serializer.instance.pk,
+                    status=serializer.validated_data.get('status', serializer.instance.status),
+                    updated_by=resolve_updated_by(request, serializer.validated_data.get('updated_by')),
+                    update_time=now,
+                    remark=serializer.validated_data.get('remark', coalescer.KEEP),
                 )
-
-                if serializer.is_valid():
+                for serializer in valid
+            ])
+        else:
+            with transaction.atomic(using=current_database()):
+                changes = []
+                for serializer in valid:
+                    before = rollups.snapshot(serializer.instance)
                     serializer.save()
-                    updated_count += 1
-                else:
-                    errors.append({"id": serial_status_id, "error": serializer.errors})
+                    changes.append((before, rollups.snapshot(serializer.instance)))
+                rollups.apply_changes(changes)
+        updated_count = len(valid)
 
         return Response({
             "updated_count": updated_count,
             "errors": errors,
             "message": "Status update completed"
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+
+class SerialTaskStatusView(APIView):
+    """
+    Set every SerialSubTaskStatus of a serial under one Task to the same status
+    with a single UPDATE (e.g. "mark whole task OK").
+    Body: serial_no, task_id, status, optional only_pending / updated_by / remark.
+    """
+    @idempotent
+    def post(self, request):
+        serial_no = request.data.get("serial_no")
+        task_id = request.data.get("task_id")
+        new_status = request.data.get("status")
+
+        if not serial_no or not task_id or not new_status:
+            return Response({"error": "Missing serial_no, task_id or status"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            task_id = serializers.IntegerField().to_internal_value(task_id)
+        except serializers.ValidationError:
+            return Response({"error": "task_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Accepts true / false, 1 / 0 and their string forms ("false" is false)
+            only_pending = serializers.BooleanField().to_internal_value(request.data.get("only_pending", False))
+        except serializers.ValidationError:
+            return Response({"error": "only_pending must be a boolean"}, status=status.HTTP_400_BAD_REQUEST)
+
+        allowed_statuses = ['pending', 'OK', 'Not_OK']
+        if new_status not in allowed_statuses:
+            return Response(
+                {'error': f"Invalid status. Allowed: {allowed_statuses}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            product_serial = ProductSerial.objects.get(serial_no=serial_no, deleting=False)
+        except ProductSerial.DoesNotExist:
+            return Response({"error": f"Product serial '{serial_no}' not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not Task.objects.filter(id=task_id).exists():
+            return Response({"error": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        statuses = SerialSubTaskStatus.objects.filter(product_serial=product_serial, task_id=task_id)
+        if only_pending:
+            statuses = statuses.filter(status='pending')
+
+        now = timezone.now()
+        fields = {
+            "status": new_status,
+            "updated_by": resolve_updated_by(request, request.data.get("updated_by")),
+            "update_time": now,
+        }
+        if "remark" in request.data:
+            fields["remark"] = request.data.get("remark")
+        if new_status != 'pending':
+            fields["first_status"] = Coalesce('first_status', Value(new_status))
+
+        with transaction.atomic(using=current_database()):
+            before = list(statuses.values_list('product_serial_id', 'subtask_id', 'update_time', 'status', 'first_status'))
+            updated_count = statuses.update(**fields)
+            rollups.apply_changes(
+                (row, (*row[:2], now, new_status, row[4] or (new_status if new_status != 'pending' else None)))
+                for row in before
+            )
+
+        checklist = (
+            SerialSubTaskStatus.objects.filter(product_serial=product_serial, task_id=task_id)
+            .select_related('product_serial__product', 'subtask__task')
+            .order_by('id')
+        )
+        return Response({
+            "serial_no": serial_no,
+            "task_id": task_id,
+            "updated_count": updated_count,
+            "subtask_statuses": SerialSubTaskStatusSerializer(checklist, many=True).data,
+            "message": "Task status update completed"
+        }, status=status.HTTP_200_OK)
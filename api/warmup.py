@@ -0,0 +1,147 @@
+"""
+Worker warm-up for gunicorn deployments (see gunicorn.conf.py).
+
+With preload_app the master imports Django and the URLconf once and forks
+every worker from it. `prime_process()` runs in the master, before the
+fork, and builds the state Django and DRF otherwise build lazily on the
+first request: compiled URL patterns and the reverse map, model _meta
+caches, the serializer fields (ModelSerializer introspection) and the
+translation catalogue. The workers inherit it copy-on-write.
+
+`warm_up()` runs in each worker after the fork. It drops any database
+connection inherited from the master (an SQLite handle must never be used
+in two processes), opens a fresh one per database, which runs the PRAGMA
+init_command and loads the schema, and with WARMUP['CATALOGUE_DIFFS']
+computes the catalogue diffs for clients up to that many versions behind.
+Django connections belong to the thread that opened them, so for a gthread
+worker the connections are opened in each thread of its request pool
+(`prime_threads()`) rather than in the worker's main thread, which never
+serves a request.
+"""
+import inspect
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+from django.utils import translation
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+from . import catalogue, serializers
+from .models import CatalogueSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def config():
+    return {'CATALOGUE_DIFFS': 0, **getattr(settings, 'WARMUP', {})}
+
+
+def _compile_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            _compile_patterns(pattern)
+
+
+def prime_urls():
+    resolver = get_resolver()
+    resolver.reverse_dict  # populates the reverse / namespace maps
+    _compile_patterns(resolver)
+
+
+def prime_models():
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta._relation_tree
+
+
+def _build_fields(serializer):
+    for field in serializer.fields.values():
+        if isinstance(field, ListSerializer):
+            field = field.child
+        if isinstance(field, BaseSerializer):
+            _build_fields(field)
+
+
+def prime_serializers():
+    """Instantiate every api serializer and build its (nested) fields once"""
+    for _, cls in inspect.getmembers(serializers, inspect.isclass):
+        if issubclass(cls, BaseSerializer) and cls.__module__ == serializers.__name__:
+            _build_fields(cls())
+
+
+def prime_process():
+    """Build the lazily-initialised, process-wide state; safe to run before forking"""
+    started = time.perf_counter()
+    prime_urls()
+    prime_models()
+    prime_serializers()
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext('This field is required.')
+    return time.perf_counter() - started
+
+
+def prime_connections():
+    """Replace inherited connections with fresh ones, one per database"""
+    connections.close_all()
+    for connection in connections.all():
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+
+def on_each_thread(pool, threads, func):
+    """Run `func` once in each of the `threads` threads of executor `pool`; returns the results"""
+    # Every task waits until all of them have started, so no thread can pick up two
+    barrier = threading.Barrier(threads, timeout=30)
+
+    def run():
+        barrier.wait()
+        return func()
+    return [future.result() for future in [pool.submit(run) for _ in range(threads)]]
+
+
+def prime_threads(pool, threads):
+    """Open the connections of every request thread of a gthread worker"""
+    connections.close_all()
+    on_each_thread(pool, threads, prime_connections)
+
+
+def prime_catalogue(versions):
+    """Compute the diffs for clients up to `versions` catalogue versions behind"""
+    if versions <= 0:
+        return 0
+    snapshot = catalogue.latest_snapshot()
+    if snapshot is None:
+        return 0
+    older = CatalogueSnapshot.objects.filter(
+        version__lt=snapshot.version, version__gte=snapshot.version - versions,
+    ).values_list('version', flat=True)
+    count = 0
+    for version in older:
+        if catalogue.cached_diff(version, snapshot) is not None:
+            count += 1
+    return count
+
+
+def warm_up(pool=None, threads=1):
+    """
+    Per-worker warm-up, run after the fork; returns the seconds it took.
+    `pool` is the request thread pool of a gthread worker, None when requests run in the main thread.
+    """
+    started = time.perf_counter()
+    if pool is None:
+        prime_connections()
+    else:
+        prime_threads(pool, threads)
+    diffs = prime_catalogue(config()['CATALOGUE_DIFFS'])
+    if pool is not None:
+        # The diff cache is shared by the threads; the main thread's connection is not used again
+        connections.close_all()
+    elapsed = time.perf_counter() - started
+    logger.info("Worker warmed up in %.1f ms (%d catalogue diffs)", elapsed * 1000, diffs)
+    return elapsed
@@ -0,0 +1,177 @@
+"""
+Benchmark for worker start-up: import time and time to first response,
+without and with the gunicorn preload + warm-up of gunicorn.conf.py.
+
+Each run starts a fresh interpreter against a throw-away SQLite database
+with a seeded catalogue and sends requests straight to the WSGI application:
+
+    cold     import Django and the app, then serve the first request
+             (a worker without preload_app)
+    preload  import and prime_process() in a parent, fork, warm_up() in the
+             child, then serve the first request (what gunicorn.conf.py does
+             for a sync worker)
+    gthread  like preload, but the child serves from a pool of --threads
+             threads, as a gthread worker does, and warm_up() primes the
+             connections of every pool thread
+    gthread-unprimed
+             like gthread, with the connections only opened in the child's
+             main thread (a warm-up that doesn't reach the request threads)
+
+    python benchmarks/startup.py --runs 5 --path /api/categories/
+
+Reports medians of the import time, the worker boot time (fork or process
+start to ready) and the latency of the first and second response. In the
+gthread modes every pool thread serves one request at a time, all threads
+at once, and the latency is the median over the threads.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+STARTED = time.perf_counter()
+
+MODES = ('cold', 'preload', 'gthread-unprimed', 'gthread')
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'user_crud.settings')
+
+
+def configure(database):
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = database
+    settings.PLANT_DATABASES = {}
+    for alias in [alias for alias in settings.DATABASES if alias != 'default']:
+        del settings.DATABASES[alias]
+    settings.WARMUP = {**getattr(settings, 'WARMUP', {}), 'CATALOGUE_DIFFS': 5}
+
+
+def prepare(database, categories):
+    """Migrate `database` and give it a catalogue (each row added stores a snapshot version)"""
+    import django
+    configure(database)
+    django.setup()
+
+    from django.core.management import call_command
+    from api.models import ProductCategory, Task, SubTask
+
+    call_command('migrate', verbosity=0)
+    for i in range(categories):
+        category = ProductCategory.objects.create(name=f"Category {i}", description="Benchmark")
+        for j in range(5):
+            task = Task.objects.create(category=category, name=f"Task {j}")
+            SubTask.objects.bulk_create([SubTask(task=task, name=f"Check {k}", description="") for k in range(10)])
+
+
+def request(application, path):
+    from wsgiref.util import setup_testing_defaults
+
+    path, _, query = path.partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET', 'HTTP_HOST': 'localhost'}
+    setup_testing_defaults(environ)
+    status = []
+    started = time.perf_counter()
+    body = b''.join(application(environ, lambda s, headers, exc_info=None: status.append(s)))
+    elapsed = time.perf_counter() - started
+    if not status[0].startswith('200'):
+        raise SystemExit(f"{path}: {status[0]} {body[:200]!r}")
+    return elapsed
+
+
+def serve(application, path, booted, pool=None, threads=1):
+    if pool is None:
+        def send():
+            return request(application, path)
+    else:
+        from api.warmup import on_each_thread
+
+        def send():
+            return statistics.median(on_each_thread(pool, threads, lambda: request(application, path)))
+    return {'boot': time.perf_counter() - booted, 'first': send(), 'second': send()}
+
+
+def child(database, path, mode, threads):
+    """One start-up; prints the timings as JSON"""
+    import django
+    configure(database)
+    django.setup()
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    result = {'import': time.perf_counter() - STARTED}
+
+    if mode == 'cold':
+        result.update(serve(application, path, STARTED))
+        print(json.dumps(result))
+        return
+
+    from api import warmup
+    result['prime'] = warmup.prime_process()
+    read, write = os.pipe()
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        if mode == 'preload':
+            warmup.warm_up()
+            timings = serve(application, path, forked)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(max_workers=threads)
+            if mode == 'gthread':
+                warmup.warm_up(pool, threads)
+            else:
+                warmup.warm_up()
+            timings = serve(application, path, forked, pool, threads)
+        os.write(write, json.dumps(timings).encode())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        result.update(json.loads(pipe.read()))
+    os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/api/catalogue/')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--child', choices=['prepare', *MODES], help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'prepare':
+        prepare(args.database, args.categories)
+        return
+    if args.child:
+        child(args.database, args.path, args.child, args.threads)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'startup.sqlite3')
+        subprocess.run([sys.executable, __file__, '--child', 'prepare', '--database', database,
+                        '--categories', str(args.categories)], check=True)
+        print(f"{args.path}, {args.runs} runs, {args.threads} threads, medians in ms")
+        print(f"{'mode':<16} {'import':>8} {'prime':>8} {'boot':>8} {'first':>8} {'second':>8}")
+        for mode in MODES:
+            runs = [
+                json.loads(subprocess.run(
+                    [sys.executable, __file__, '--child', mode, '--database', database, '--path', args.path,
+                     '--threads', str(args.threads)],
+                    check=True, capture_output=True, text=True,
+                ).stdout)
+                for _ in range(args.runs)
+            ]
+            medians = {key: statistics.median(run.get(key, 0) for run in runs) * 1000
+                       for key in ('import', 'prime', 'boot', 'first', 'second')}
+            print(f"{mode:<16} " + " ".join(f"{value:>8.1f}" for value in medians.values()))
+
+
+if __name__ == '__main__':
+    main()
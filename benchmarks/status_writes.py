@@ -0,0 +1,151 @@
+"""
+Benchmark for POST /api/subtask-status-update/ under concurrent stations:
+one transaction per request (current behaviour) vs the group-commit
+coalescer (api/coalescer.py).
+
+Runs the full Django request stack in-process against throw-away SQLite
+files, with one thread per station:
+
+    python benchmarks/status_writes.py --stations 32 --requests 50
+
+With --plants N the stations are spread over N plant databases (see
+api/routers.py), each with its own writer lock.
+
+Reports requests/s, commits/s and p50 / p95 / p99 / max latency per mode.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'user_crud.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+
+def setup(directory, plants):
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    settings.PLANT_DATABASES = {f'p{i}': f'plant_p{i}' for i in range(plants)}
+    for plant, alias in settings.PLANT_DATABASES.items():
+        settings.DATABASES[alias] = {**settings.DATABASES['default'], 'NAME': os.path.join(directory, f'{plant}.sqlite3')}
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connections
+    for alias in connections:
+        call_command('migrate', database=alias, verbosity=0)
+
+
+def seed(stations, subtasks):
+    """[(plant or None, serial_no, status ids)] for each station"""
+    from api.catalogue import sync_replicas
+    from api.models import ProductCategory, Task, SubTask, ProductSerial, SerialSubTaskStatus
+    from api.routers import use_database
+
+    category = ProductCategory.objects.create(name="Benchmark")
+    task = Task.objects.create(category=category, name="Assembly")
+    subtask_objs = SubTask.objects.bulk_create([
+        SubTask(task=task, name=f"Check {i}", description="") for i in range(subtasks)
+    ])
+    sync_replicas()
+
+    plants = list(settings.PLANT_DATABASES.items()) or [(None, 'default')]
+    result = []
+    for i in range(stations):
+        plant, alias = plants[i % len(plants)]
+        with use_database(alias):
+            serial = ProductSerial.objects.create(serial_no=f"BENCH-{i:04d}", product=category, product_name="Benchmark")
+            SerialSubTaskStatus.objects.bulk_create([
+                SerialSubTaskStatus(product_serial=serial, subtask=subtask, task=task, category=category)
+                for subtask in subtask_objs
+            ])
+            ids = list(SerialSubTaskStatus.objects.filter(product_serial=serial).values_list('id', flat=True))
+        result.append((plant, serial.serial_no, ids))
+    return result
+
+
+def run(stations, requests_per_station, items_per_request):
+    from django.db import connections
+    from django.test import Client
+
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(len(stations))
+
+    def station(plant, serial_no, ids):
+        client = Client(SERVER_NAME='localhost', headers={"X-Plant": plant} if plant else {})
+        start_line.wait()
+        try:
+            for n in range(requests_per_station):
+                body = {"serial_no": serial_no, "updates": [
+                    {"id": pk, "status": ("OK", "Not_OK")[n % 2], "updated_by": "bench"}
+                    for pk in ids[:items_per_request]
+                ]}
+                started = time.perf_counter()
+                response = client.post('/api/subtask-status-update/', body, content_type='application/json')
+                elapsed = time.perf_counter() - started
+                with lock:
+                    (latencies if response.status_code == 200 else failures).append(elapsed)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=station, args=item) for item in stations]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, failures
+
+
+def report(name, wall, latencies, failures, commits):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    ms = lambda seconds: f"{seconds * 1000:8.1f}"  # noqa: E731
+    print(
+        f"{name:<10} {len(latencies) / wall:9.0f} {commits / wall:10.0f} "
+        f"{ms(quantiles[49])} {ms(quantiles[94])} {ms(quantiles[98])} {ms(latencies[-1])} {len(failures):7d}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stations', type=int, default=32, help="Concurrent clients, one serial each")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per station")
+    parser.add_argument('--items', type=int, default=5, help="Status rows updated per request")
+    parser.add_argument('--max-delay-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=200)
+    parser.add_argument('--plants', type=int, default=0, help="Spread stations over this many plant databases")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup(tmp, args.plants)
+        stations = seed(args.stations, args.items)
+
+        from api import coalescer
+
+        print(f"{args.stations} stations x {args.requests} requests x {args.items} rows, "
+              f"{args.plants or 'no'} plant database(s)")
+        print(f"{'mode':<10} {'req/s':>9} {'commits/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'max ms':>8} {'errors':>7}")
+
+        settings.STATUS_WRITE_COALESCER = {'ENABLED': False}
+        wall, latencies, failures = run(stations, args.requests, args.items)
+        report("direct", wall, latencies, failures, commits=len(latencies))
+
+        settings.STATUS_WRITE_COALESCER = {
+            'ENABLED': True, 'MAX_DELAY_MS': args.max_delay_ms, 'MAX_BATCH': args.max_batch,
+        }
+        wall, latencies, failures = run(stations, args.requests, args.items)
+        report("coalesced", wall, latencies, failures, commits=coalescer.get_coalescer().batches_committed)
+
+
+if __name__ == '__main__':
+    main()
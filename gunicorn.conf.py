@@ -0,0 +1,52 @@
+"""
+gunicorn settings, picked up automatically from the working directory:
+
+    gunicorn user_crud.wsgi
+
+The app is imported and primed once in the master (preload_app + when_ready)
+and every worker warms its database connections once it has loaded the app
+(post_worker_init); a gthread worker opens them in each of its request
+threads, since Django connections are per thread. See api/warmup.py. Threaded workers let the status write coalescer
+(STATUS_WRITE_COALESCER) merge writes from concurrent requests.
+
+Workers keep their /metrics values in PROMETHEUS_MULTIPROC_DIR (see
+api/metrics.py), which is emptied when the server starts.
+"""
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+
+# Must be set before the app (and prometheus_client) is imported
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'pqc-metrics'))
+
+
+def on_starting(server):
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def when_ready(server):
+    from api.warmup import prime_process
+    server.log.info("Primed the app in %.1f ms", prime_process() * 1000)
+
+
+def post_worker_init(worker):
+    from api.warmup import warm_up
+    # gthread workers create their request thread pool (tpool) before this hook runs
+    warm_up(getattr(worker, 'tpool', None), worker.cfg.threads)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,12 +39,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'django_filters',
     'api',
     'corsheaders',
      
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -52,6 +55,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.PlantMiddleware',
+    'api.middleware.ProfilingMiddleware',
       
 ]
 
@@ -82,9 +87,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL: readers (and online backups, see backup_db) don't block writers
+        'OPTIONS': {'init_command': 'PRAGMA journal_mode=WAL;'},
+        # Keep connections open between requests so workers don't reopen the file and reload the schema
+        'CONN_MAX_AGE': 600,
     }
 }
 
+# One database per plant for product serials and statuses, e.g. PQC_PLANTS="north,south"
+# gives db_north.sqlite3 and db_south.sqlite3. Requests pick one with the X-Plant header
+# or ?plant= (see api/routers.py); the catalogue stays in 'default'.
+PLANT_DATABASES = {
+    plant: f'plant_{plant}'
+    for plant in filter(None, (p.strip() for p in os.environ.get('PQC_PLANTS', '').split(',')))
+}
+for _plant, _alias in PLANT_DATABASES.items():
+    DATABASES[_alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_{_plant}.sqlite3',
+        'OPTIONS': DATABASES['default']['OPTIONS'],
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+    }
+
+DATABASE_ROUTERS = ['api.routers.PlantRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,4 +154,55 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# How long a stored response is replayed for a retried `Idempotency-Key` (seconds)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# A key still marked in progress after this long belongs to a crashed request and may be retried (seconds)
+IDEMPOTENCY_PENDING_TIMEOUT = 60
+
+# Default lease a station gets on a claimed product serial (seconds)
+STATION_LEASE_SECONDS = 10 * 60
+
+# Catalogue snapshot versions kept for diffing; older clients get the full snapshot
+CATALOGUE_SNAPSHOTS_KEPT = 50
+
+# Chunked deletions (?mode=chunked / bulk-delete): rows per transaction and pause between chunks (seconds)
+DELETION_CHUNK_SIZE = 500
+DELETION_CHUNK_PAUSE = 0.05
+DELETION_IN_BACKGROUND = True
+
+# Group commit for subtask-status-update (api/coalescer.py): writes from concurrent requests
+# are merged for up to MAX_DELAY_MS or MAX_BATCH rows and committed in one transaction.
+# Only useful with threaded workers; TIMEOUT is how long a request waits for its batch (seconds)
+STATUS_WRITE_COALESCER = {
+    'ENABLED': False,
+    'MAX_DELAY_MS': 5,
+    'MAX_BATCH': 200,
+    'TIMEOUT': 10,
+}
+
+# /api/batch/: sub-requests per batch, and threads for running consecutive GETs concurrently (1 = in order)
+BATCH_MAX_REQUESTS = 50
+BATCH_READ_WORKERS = 4
 
+# Where backup_db writes its snapshots
+BACKUP_DIR = BASE_DIR / 'backups'
+
+# Request profiler (api/profiling.py): staff add ?_profile=cpu|mem or an X-Profile header.
+# SAMPLE_RATE profiles that share of all requests; DIR keeps the newest KEEP profiles, TOP rows each
+PROFILING = {
+    'SAMPLE_RATE': 0.0,
+    'DIR': BASE_DIR / 'profiles',
+    'KEEP': 200,
+    'TOP': 25,
+}
+
+# Worker warm-up after gunicorn forks (api/warmup.py, gunicorn.conf.py). CATALOGUE_DIFFS pre-computes
+# the catalogue diffs for clients up to that many versions behind (0 leaves the cache cold)
+WARMUP = {
+    'CATALOGUE_DIFFS': 0,
+}
+
+# Prometheus metrics at /metrics (api/metrics.py). With a TOKEN, scrapes must send "Authorization: Bearer <TOKEN>"
+METRICS = {
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}